@@ -1,61 +1,888 @@
 # app.py - Production-Ready QR Scanner Flask App
+import atexit
+import hmac
+import ipaddress
 import os
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Request, Response, g, jsonify, request, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 import json
+import math
+import shutil
+import tempfile
+import time
+import zipfile
 from datetime import datetime
+from broadcast import Broadcaster
+from classifier import classify, classify_many
+from decode_jobs import JobManager, JobQueueFull
+from dedupe import DuplicateFilter
+from forwarding import Forwarder, open_sink, spill_dir_for
+from history_export import EXPORT_FORMATS, filter_records, stream_export
+from history_store import open_history_store
+from ingest_queue import IngestQueue, QueueFull
+from metrics import RequestMetrics
+from partitioned_history import PartitionedHistory
+from profiling import SORT_KEYS, RequestProfiler
+from rate_limit import RateLimiter, address_key, open_buckets, parse_limit
+from qr_decode import DecodePool, DecoderBusy, DecoderUnavailable, available as decoder_available
+from response_cache import CachedPayload, ResponseCache, StaticPage
+from retention import Compactor
+from scan_stats import ScanStats
+from search_index import SearchIndex, scan_search
 
 app = Flask(__name__)
 
-# Simple in-memory storage for scan history
-scan_history = []
+# Behind TRUSTED_PROXIES reverse proxies, the client address is taken from
+# the X-Forwarded-For entry the outermost trusted proxy added
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+def optional_env(name, convert):
+    value = os.environ.get(name)
+    return convert(value) if value else None
+
+# Scan history (newest first); HISTORY_BACKEND=shared shares it across workers
+HISTORY_CAPACITY = int(os.environ.get('HISTORY_CAPACITY', 100))
+# HISTORY_SCOPE=client gives every client its own in-memory history of
+# HISTORY_CAPACITY scans, with HISTORY_MAX_BYTES as the budget across all
+HISTORY_SCOPE = os.environ.get('HISTORY_SCOPE', 'global')
+if HISTORY_SCOPE == 'client':
+    if os.environ.get('HISTORY_BACKEND', 'memory') != 'memory':
+        raise ValueError('HISTORY_SCOPE=client requires HISTORY_BACKEND=memory')
+    scan_history = PartitionedHistory(
+        HISTORY_CAPACITY,
+        max_bytes=optional_env('HISTORY_MAX_BYTES', int),
+        max_partitions=int(os.environ.get('MAX_HISTORY_CLIENTS', 10000)),
+        idle_seconds=optional_env('CLIENT_IDLE_SECONDS', float)
+    )
+elif HISTORY_SCOPE == 'global':
+    scan_history = open_history_store(
+        os.environ.get('HISTORY_BACKEND', 'memory'),
+        HISTORY_CAPACITY,
+        os.environ.get('HISTORY_PATH'),
+        max_bytes=optional_env('HISTORY_MAX_BYTES', int)
+    )
+else:
+    raise ValueError(f'Unknown HISTORY_SCOPE: {HISTORY_SCOPE}')
+
+# Age and size limits enforced in the background on top of the capacity
+compactor = Compactor(
+    scan_history,
+    ttl=optional_env('HISTORY_TTL_SECONDS', float),
+    max_bytes=optional_env('HISTORY_MAX_BYTES', int),
+    interval=float(os.environ.get('COMPACTION_INTERVAL_SECONDS', 60))
+)
+
+# Token and type index for /api/history/search; backends that other
+# processes write to cannot feed it, so search falls back to a scan there,
+# as it does over the small per-client histories
+try:
+    search_index = SearchIndex()
+    scan_history.add_listener(search_index)
+except (NotImplementedError, AttributeError):
+    search_index = None
+
+# Repeat scans of the same code by the same client within the window are
+# counted on the existing record instead of being saved again
+duplicate_filter = DuplicateFilter(float(os.environ.get('DEDUPE_WINDOW_SECONDS', 5)))
+
+# Running totals, top contents and scan rates for /api/stats, counted by
+# this process only, whichever history backend is in use; a clear by any
+# worker sharing the history resets them
+scan_stats = ScanStats()
+
+# Live scan events for /api/stream subscribers
+scan_events = Broadcaster(int(os.environ.get('STREAM_QUEUE_SIZE', 100)))
+SSE_KEEPALIVE_SECONDS = 15
+
+# Saved and repeat scans shipped in gzip NDJSON batches to each FORWARD_TO
+# target (comma-separated webhook URLs or file paths)
+FORWARD_SPILL_DIR = (os.environ.get('FORWARD_SPILL_DIR')
+                     or os.path.join(tempfile.gettempdir(), 'qr-forward-spill'))
+forwarders = [
+    Forwarder(
+        open_sink(target, float(os.environ.get('FORWARD_TIMEOUT_SECONDS', 10))),
+        spill_dir_for(FORWARD_SPILL_DIR, target),
+        batch_size=int(os.environ.get('FORWARD_BATCH_SIZE', 500)),
+        flush_seconds=float(os.environ.get('FORWARD_FLUSH_SECONDS', 5)),
+        max_retries=int(os.environ.get('FORWARD_MAX_RETRIES', 3)),
+        max_spill_bytes=int(os.environ.get('FORWARD_MAX_SPILL_BYTES', 100 * 1024 * 1024))
+    )
+    for target in filter(None, map(str.strip, os.environ.get('FORWARD_TO', '').split(',')))
+]
+for forwarder in forwarders:
+    # Registered before the ingest queue's hook, so it runs after it
+    atexit.register(forwarder.close, float(os.environ.get('FORWARD_FLUSH_TIMEOUT_SECONDS', 10)))
+
+def announce(event, record, client):
+    """Tell stream subscribers and forwarding sinks about a saved or repeat scan"""
+    data = record.to_dict()
+    scan_events.publish(event, data, history_key(client))
+    if forwarders:
+        store = client_history(client).store_id
+        for forwarder in forwarders:
+            forwarder.submit(dict(data, event=event, client=client, store=store))
+
+# Encoded history pages, rebuilt only after the history changes
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024)))
+
+# Per-endpoint counts, latency and response sizes for /metrics
+request_metrics = RequestMetrics()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_background_tasks():
+    compactor.ensure_started()
+    for forwarder in forwarders:
+        forwarder.ensure_started()
+    if ingest_queue is not None:
+        ingest_queue.ensure_started()
+
+# Token buckets per client address for each budget set to `N/s`, `N/m` or
+# `N/h`; the shared and sqlite backends let every worker draw from one bucket.
+# X-Client-ID is not used, since a client could rotate it to get fresh buckets
+RATE_LIMITS = {
+    budget: parse_limit(os.environ[f'RATE_LIMIT_{budget.upper()}'])
+    for budget in ('write', 'read', 'export') if os.environ.get(f'RATE_LIMIT_{budget.upper()}')
+}
+rate_limiter = RateLimiter(RATE_LIMITS, open_buckets(
+    os.environ.get('RATE_LIMIT_BACKEND') or (
+        'memory' if HISTORY_SCOPE == 'client' else os.environ.get('HISTORY_BACKEND', 'memory')),
+    os.environ.get('RATE_LIMIT_PATH')
+)) if RATE_LIMITS else None
+RATE_LIMIT_BUDGETS = {
+    'save_scan': 'write', 'save_scans': 'write', 'decode_images': 'write',
+    'create_decode_job': 'write', 'cancel_decode_job': 'write', 'clear_history': 'write',
+    'get_history': 'read', 'search_history': 'read', 'get_stats': 'read',
+    'classify_content': 'read', 'get_queued_scan': 'read', 'list_decode_jobs': 'read',
+    'get_decode_job': 'read', 'stream_scans': 'read',
+    'export_history': 'export',
+}
+
+@app.before_request
+def enforce_rate_limit():
+    budget = RATE_LIMIT_BUDGETS.get(request.endpoint)
+    if rate_limiter is not None and budget is not None:
+        wait = rate_limiter.check(budget, address_key(request.remote_addr))
+        if wait:
+            response = jsonify({'error': f'Too many {budget} requests, retry later'})
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response, 429
+
+# Scan payloads are capped at the largest QR code (4296 characters), and
+# request bodies on these endpoints are limited while they are read, so a
+# chunked body without a Content-Length cannot get past the cap either
+MAX_SCAN_BYTES = int(os.environ.get('MAX_SCAN_BYTES', 4296))
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 1024 * 1024))
+MAX_DECODE_REQUEST_BYTES = int(os.environ.get('MAX_DECODE_REQUEST_BYTES', 32 * 1024 * 1024))
+MAX_JOB_ARCHIVE_BYTES = int(os.environ.get('MAX_JOB_ARCHIVE_BYTES', 512 * 1024 * 1024))
+REQUEST_BYTE_LIMITS = {
+    'save_scan': MAX_REQUEST_BYTES, 'save_scans': MAX_REQUEST_BYTES,
+    'classify_content': MAX_REQUEST_BYTES, 'decode_images': MAX_DECODE_REQUEST_BYTES,
+    'create_decode_job': MAX_JOB_ARCHIVE_BYTES,
+}
+# Spooled to disk by the view, which handles the limit itself
+STREAMED_ENDPOINTS = {'create_decode_job'}
+
+class SizeLimitedRequest(Request):
+    """Applies REQUEST_BYTE_LIMITS to the input stream of the matched endpoint"""
+
+    @property
+    def max_content_length(self):
+        limit = REQUEST_BYTE_LIMITS.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+app.request_class = SizeLimitedRequest
+
+@app.before_request
+def limit_request_size():
+    limit = REQUEST_BYTE_LIMITS.get(request.endpoint)
+    if limit is None:
+        return None
+    if request.endpoint in STREAMED_ENDPOINTS:
+        if (request.content_length or 0) > limit:
+            return request_too_large(limit)
+        return None
+    try:
+        # Read (or parse, for uploads) the body now, so an oversized one is
+        # refused here rather than surfacing inside the view
+        request.get_data(parse_form_data=True)
+        if request.content_length is None:
+            # A body cut off at the limit only raises on the next read
+            request.stream.read(1)
+    except RequestEntityTooLarge:
+        return request_too_large(limit)
+
+def request_too_large(limit):
+    return jsonify({'error': f'Request body exceeds {limit} bytes'}), 413
+
+def scan_too_large(content):
+    # Any character takes at most 4 bytes in UTF-8, so most payloads skip encoding
+    return len(content) * 4 > MAX_SCAN_BYTES and len(content.encode('utf-8')) > MAX_SCAN_BYTES
+
+# PROFILING=1 profiles every PROFILE_EVERY-th request, and any request with
+# the PROFILE_HEADER header, with cProfile; summaries at /admin/profile
+PROFILING = os.environ.get('PROFILING', '').lower() in ('1', 'true', 'yes')
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile')
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+profiler = RequestProfiler(
+    every=int(os.environ.get('PROFILE_EVERY', 0)),
+    directory=os.environ.get('PROFILE_DIR')
+) if PROFILING else None
+
+def profile_requested():
+    value = request.headers.get(PROFILE_HEADER)
+    if not value:
+        return False
+    # With an admin token configured, only its holder can trigger profiles
+    return token_matches(value) if ADMIN_TOKEN is not None else from_loopback()
+
+def token_matches(supplied):
+    return supplied is not None and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+def from_loopback():
+    try:
+        return ipaddress.ip_address(request.remote_addr).is_loopback
+    except ValueError:
+        return False
+
+@app.before_request
+def start_profiling():
+    if profiler is not None and (profiler.due() or profile_requested()):
+        g.profile = profiler.start()
+
+@app.teardown_request
+def stop_profiling(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, request.endpoint or 'unmatched')
+
+def metrics_method():
+    """The request method as a metrics label: one the route accepts, else `other`"""
+    rule = request.url_rule
+    return request.method if rule is not None and request.method in rule.methods else 'other'
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_metrics.observe(
+            request.endpoint or 'unmatched',
+            metrics_method(),
+            response.status_code,
+            time.perf_counter() - started,
+            response.calculate_content_length()
+        )
+    return response
+
+# The page is plain HTML, so it is served from memory instead of rendered
+index_page = StaticPage(os.path.join(app.root_path, 'templates', 'qr_scanner.html'))
+index_page.load()
 
 @app.route('/')
 def index():
-    return render_template('qr_scanner.html')
+    return index_page.to_response(request.if_none_match, accepts_gzip())
+
+def client_key():
+    """Identify the scanning device (X-Client-ID header, else remote address)
+
+    The two are namespaced, so a header naming another device's address
+    does not reach that device's history.
+    """
+    client_id = request.headers.get('X-Client-ID')
+    return f'id:{client_id}' if client_id else f'ip:{request.remote_addr}'
+
+def client_history(client):
+    """The history a client reads and writes: its own, or the global one"""
+    if HISTORY_SCOPE == 'client':
+        return scan_history.for_client(client)
+    return scan_history
+
+def history_key(client):
+    """The client's partition key, or None when history is global"""
+    return client if HISTORY_SCOPE == 'client' else None
+
+def recent_repeat(history, content, client, now):
+    """The record a repeat scan counts against, if the history still holds it"""
+    record = duplicate_filter.check(content, client, now)
+    if record is not None and not history.contains(record):
+        # Evicted, expired or cleared since; the scan is saved afresh
+        return None
+    return record
+
+def ingest_scan(content, client):
+    """Save one scan through dedupe, stats and events; returns the response body"""
+    scan_stats.sync(scan_history.clears)
+    history = client_history(client)
+    now = time.monotonic()
+    record = recent_repeat(history, content, client, now)
+    if record is not None:
+        history.increment(record)
+        scan_stats.record(record.type, content)
+        announce('repeat', record, client)
+        return {'success': True, 'message': 'Repeat scan counted',
+                'duplicate': True, 'count': record.count}
+
+    # The server decides the type so it is consistent across clients
+    scan_type, fields = classify(content)
+    record = history.append(content, scan_type, time.time())
+    duplicate_filter.remember(content, client, record, now)
+    scan_stats.record(record.type, content)
+    announce('scan', record, client)
+    return {'success': True, 'message': 'Scan saved', 'type': scan_type, 'fields': fields}
 
 @app.route('/api/save_scan', methods=['POST'])
 def save_scan():
     """Save scan result to history"""
     try:
         data = request.get_json()
-        scan_data = {
-            'content': data.get('content', ''),
-            'type': data.get('type', 'unknown'),
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        scan_history.insert(0, scan_data)
-        
-        # Keep only last 100 scans
-        if len(scan_history) > 100:
-            scan_history.pop()
-            
-        return jsonify({'success': True, 'message': 'Scan saved'})
+        content = data.get('content', '')
+        if not isinstance(content, str):
+            return jsonify({'error': 'content must be a string'}), 400
+        if scan_too_large(content):
+            return jsonify({'error': f'content exceeds {MAX_SCAN_BYTES} bytes'}), 413
+        if ingest_queue is not None:
+            return enqueue_scan(content)
+        return jsonify(ingest_scan(content, client_key()))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def enqueue_scan(content):
+    """Accept a scan for the write-behind queue: 202 with its id, or 429 when full"""
+    try:
+        scan_id = ingest_queue.submit(content, client_key())
+    except QueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(ingest_queue.retry_after())
+        return response, 429
+    response = jsonify({'success': True, 'message': 'Scan queued', 'queued': True, 'id': scan_id})
+    response.headers['Location'] = f'/api/save_scan/{scan_id}'
+    return response, 202
+
+@app.route('/api/save_scan/<scan_id>')
+def get_queued_scan(scan_id):
+    """Whether a scan accepted by the write-behind queue has been saved"""
+    result = ingest_queue.result(scan_id) if ingest_queue is not None else None
+    if result is None:
+        return jsonify({'error': 'Unknown scan'}), 404
+    return jsonify(dict(result, id=scan_id))
+
+# Worker processes decoding uploaded images for /api/decode
+decode_pool = DecodePool(
+    workers=optional_env('DECODE_WORKERS', int),
+    max_pending=int(os.environ.get('DECODE_QUEUE_SIZE', 64)),
+    timeout=float(os.environ.get('DECODE_TIMEOUT_SECONDS', 10))
+)
+MAX_DECODE_IMAGES = int(os.environ.get('MAX_DECODE_IMAGES', 16))
+
+@app.route('/api/decode', methods=['POST'])
+def decode_images():
+    """Decode QR codes in uploaded images and save them like save_scan
+
+    Takes multipart file uploads or a raw image body; `save=0` only decodes.
+    """
+    if request.files:
+        uploads = [(upload.filename, upload.read())
+                   for key in request.files for upload in request.files.getlist(key)]
+    else:
+        body = request.get_data()
+        uploads = [(None, body)] if body else []
+    if not uploads:
+        return jsonify({'error': 'No image uploaded'}), 400
+    if len(uploads) > MAX_DECODE_IMAGES:
+        return jsonify({'error': f'At most {MAX_DECODE_IMAGES} images per request'}), 413
+    save = request.args.get('save', '1').lower() not in ('0', 'false', 'no')
+
+    try:
+        outcomes = decode_pool.decode([data for _, data in uploads])
+    except DecoderUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+    if all(isinstance(outcome, DecoderBusy) for outcome in outcomes):
+        response = jsonify({'error': 'Decoder is busy, retry shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    client = client_key()
+    results = []
+    for index, ((filename, _), outcome) in enumerate(zip(uploads, outcomes)):
+        result = {'index': index, 'filename': filename}
+        if isinstance(outcome, Exception):
+            result.update(success=False, error=str(outcome))
+        else:
+            for code in outcome:
+                if save and scan_too_large(code['content']):
+                    code.update(success=False, error=f'content exceeds {MAX_SCAN_BYTES} bytes')
+                elif save:
+                    code.update(ingest_scan(code['content'], client))
+                else:
+                    code['type'], code['fields'] = classify(code['content'])
+            result.update(success=True, codes=outcome)
+        results.append(result)
+    return jsonify({'success': True, 'results': results})
+
+# ZIP archives of images decoded in the background by the same pool
+decode_jobs = JobManager(
+    decode_pool,
+    lambda contents, job: sum(ingest_batch(
+        [(content, time.time()) for content in contents if not scan_too_large(content)],
+        job.owner)),
+    batch_size=int(os.environ.get('DECODE_JOB_BATCH_SIZE', 100)),
+    max_queued=int(os.environ.get('MAX_QUEUED_JOBS', 16))
+)
+DECODE_JOB_DIR = os.environ.get('DECODE_JOB_DIR') or tempfile.gettempdir()
+
+@app.route('/api/jobs', methods=['POST'])
+def create_decode_job():
+    """Start decoding a ZIP archive of images (multipart `archive` or raw body)"""
+    if decode_jobs.full():
+        return decode_jobs_busy()
+    # Spool the upload to disk so memory does not grow with the archive;
+    # the request stream stops at MAX_JOB_ARCHIVE_BYTES
+    with tempfile.NamedTemporaryFile(dir=DECODE_JOB_DIR, prefix='qr-job-', suffix='.zip',
+                                     delete=False) as archive:
+        try:
+            upload = request.files.get('archive')
+            source = upload.stream if upload else request.stream
+            filename = upload.filename if upload else None
+            shutil.copyfileobj(source, archive, 1024 * 1024)
+            if request.content_length is None:
+                # A body cut off at the limit only raises on the next read
+                request.stream.read(1)
+        except RequestEntityTooLarge:
+            too_large = True
+        else:
+            too_large = False
+    if too_large:
+        os.remove(archive.name)
+        return request_too_large(MAX_JOB_ARCHIVE_BYTES)
+    if not zipfile.is_zipfile(archive.name):
+        os.remove(archive.name)
+        return jsonify({'error': 'Expected a ZIP archive'}), 400
+    if not decoder_available():
+        os.remove(archive.name)
+        return jsonify({'error': 'Install Pillow and zxing-cpp to decode images'}), 501
+
+    try:
+        job = decode_jobs.submit(archive.name, filename, owner=client_key())
+    except JobQueueFull:
+        os.remove(archive.name)
+        return decode_jobs_busy()
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response, 202
+
+def decode_jobs_busy():
+    response = jsonify({'error': 'Too many decode jobs are waiting, retry later'})
+    response.headers['Retry-After'] = '30'
+    return response, 503
+
+@app.route('/api/jobs', methods=['GET'])
+def list_decode_jobs():
+    """Progress of recent archive jobs"""
+    return jsonify({'jobs': [job.to_dict() for job in decode_jobs.jobs()]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_decode_job(job_id):
+    """Progress and throughput of one archive job"""
+    job = decode_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_decode_job(job_id):
+    """Stop an archive job after the images already being decoded"""
+    job = decode_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+def ingest_batch(batch, client):
+    """Save (content, created) scans with one history write; returns whether each was new
+
+    Each scan keeps its own `created` time. Repeats, of earlier scans or
+    within the batch, are counted on the existing record instead (False
+    in the result) when they fall within the dedupe window of the
+    previous scan of that code, judged by when each scan was made.
+    """
+    scan_stats.sync(scan_history.clears)
+    history = client_history(client)
+    wall = time.time()
+    now = time.monotonic()
+    scans = []
+    repeats = []  # extra scans of each new record folded in from this batch
+    last_seen = []  # monotonic time of each new record's latest scan
+    batch_index = {}
+    saved = []
+    for content, created in batch:
+        # When the scan was made, on the clock the dedupe window runs on
+        seen = now - max(0.0, wall - created)
+        record = recent_repeat(history, content, client, seen)
+        if record is not None:
+            history.increment(record)
+            scan_stats.record(record.type, content, now=created)
+            announce('repeat', record, client)
+            saved.append(False)
+            continue
+        index = batch_index.get(content)
+        if (index is not None and duplicate_filter.window > 0
+                and seen - last_seen[index] <= duplicate_filter.window):
+            repeats[index] += 1
+            last_seen[index] = seen
+            saved.append(False)
+            continue
+
+        batch_index[content] = len(scans)
+        scans.append((content, classify(content)[0], created))
+        repeats.append(0)
+        last_seen.append(seen)
+        saved.append(True)
+
+    records = history.extend(scans)
+    for record, extra, seen in zip(records, repeats, last_seen):
+        duplicate_filter.remember(record.content, client, record, seen)
+        if extra:
+            history.increment(record, extra)
+        scan_stats.record(record.type, record.content, 1 + extra, now=record.created)
+        announce('scan', record, client)
+    return saved
+
+# INGEST_QUEUE_SIZE > 0 makes save_scan write-behind: scans are queued and
+# saved in batches by a background thread, and a full queue answers 429
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 0))
+ingest_queue = IngestQueue(
+    ingest_batch,
+    max_size=INGEST_QUEUE_SIZE,
+    batch_size=int(os.environ.get('INGEST_BATCH_SIZE', 100))
+) if INGEST_QUEUE_SIZE > 0 else None
+if ingest_queue is not None:
+    # Runs in each gunicorn worker as it exits, and on a plain interpreter exit
+    atexit.register(ingest_queue.close, float(os.environ.get('INGEST_FLUSH_TIMEOUT_SECONDS', 25)))
+
+MAX_BATCH_SCANS = int(os.environ.get('MAX_BATCH_SCANS', 1000))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def parse_scan_batch(body, mimetype):
+    """Split a JSON array or NDJSON body into items (None for unparseable lines)"""
+    if mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array of scans')
+    return items
+
+@app.route('/api/save_scans', methods=['POST'])
+def save_scans():
+    """Save a batch of scans (JSON array or NDJSON) to history"""
+    try:
+        items = parse_scan_batch(request.get_data(as_text=True), request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(items) > MAX_BATCH_SCANS:
+        return jsonify({'error': f'Batch exceeds {MAX_BATCH_SCANS} scans'}), 413
+
+    valid = []
+    results = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'error': 'Invalid scan'})
+        elif not isinstance(item.get('content', ''), str):
+            results.append({'index': index, 'success': False, 'error': 'content must be a string'})
+        elif scan_too_large(item.get('content', '')):
+            results.append({'index': index, 'success': False,
+                            'error': f'content exceeds {MAX_SCAN_BYTES} bytes'})
+        else:
+            valid.append(item.get('content', ''))
+            results.append({'index': index, 'success': True})
+
+    try:
+        created = time.time()
+        saved = ingest_batch([(content, created) for content in valid], client_key())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    outcomes = iter(saved)
+    for result in results:
+        if result['success'] and not next(outcomes):
+            result['duplicate'] = True
+
+    failed = len(items) - len(valid)
+    return jsonify({
+        'success': True,
+        'saved': sum(saved),
+        'duplicates': len(valid) - sum(saved),
+        'failed': failed,
+        'results': results
+    })
+
+@app.route('/api/classify', methods=['POST'])
+def classify_content():
+    """Classify and parse payloads without saving them
+
+    Accepts {"content": "..."} or a JSON array of strings.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('content'), str):
+        if scan_too_large(data['content']):
+            return jsonify({'error': f'content exceeds {MAX_SCAN_BYTES} bytes'}), 413
+        scan_type, fields = classify(data['content'])
+        return jsonify({'type': scan_type, 'fields': fields})
+    if isinstance(data, list) and all(isinstance(item, str) for item in data):
+        if len(data) > MAX_BATCH_SCANS:
+            return jsonify({'error': f'Batch exceeds {MAX_BATCH_SCANS} items'}), 413
+        fitting = [item for item in data if not scan_too_large(item)]
+        classified = iter(classify_many(fitting))
+        results = []
+        for item in data:
+            if scan_too_large(item):
+                results.append({'error': f'content exceeds {MAX_SCAN_BYTES} bytes'})
+            else:
+                scan_type, fields = next(classified)
+                results.append({'type': scan_type, 'fields': fields})
+        return jsonify({'results': results})
+    return jsonify({'error': 'Expected {"content": "..."} or an array of strings'}), 400
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 500
+
 @app.route('/api/history')
 def get_history():
-    """Get scan history"""
+    """Get a page of scan history, newest first
+
+    Pass the returned `next_before` as `before` to fetch the next page.
+    `since` and `until` restrict the page to a time range. Responses carry
+    the history version as an ETag, so unchanged history is answered with
+    304 Not Modified.
+    """
+    try:
+        before = request.args.get('before', type=int)
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        since = parse_time_arg('since')
+        until = parse_time_arg('until')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+    partition = history_key(client_key())
+    history = client_history(partition)
+    etag = history.version
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        def build():
+            records = history.page(before, limit, since, until)
+            return CachedPayload(app.json.dumps({
+                'history': [record.to_dict() for record in records],
+                'total': len(history),
+                'next_before': records[-1].id if len(records) == limit else None
+            }).encode('utf-8'))
+        key = ('history', partition, before, limit, since, until)
+        payload = response_cache.get(key, etag, build)
+        response = payload.to_response(accepts_gzip())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def accepts_gzip():
+    return 'gzip' in request.accept_encodings
+
+@app.route('/api/history/search')
+def search_history():
+    """Find scans by substring, content prefix and type, newest first"""
+    substring = request.args.get('q') or None
+    prefix = request.args.get('prefix') or None
+    types = set(filter(None, request.args.get('type', '').split(',')))
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), MAX_HISTORY_PAGE_SIZE))
+
+    if search_index is not None:
+        records = search_index.search(substring, prefix, types, limit)
+    else:
+        records = scan_search(client_history(client_key()), substring, prefix, types, limit)
     return jsonify({
-        'history': scan_history[:50],  # Return last 50 scans
-        'total': len(scan_history)
+        'results': [record.to_dict() for record in records],
+        'count': len(records)
     })
 
 @app.route('/api/history/clear', methods=['DELETE'])
 def clear_history():
     """Clear scan history"""
-    global scan_history
+    if HISTORY_SCOPE == 'client':
+        # Only the caller's own history; stats stay global
+        client = client_key()
+        client_history(client).clear()
+        duplicate_filter.forget(client)
+        scan_events.publish('clear', {}, client)
+        return jsonify({'success': True, 'message': 'History cleared'})
     scan_history.clear()
+    duplicate_filter.clear()
+    scan_stats.clear()
+    scan_stats.sync(scan_history.clears)
+    scan_events.publish('clear', {})
     return jsonify({'success': True, 'message': 'History cleared'})
 
+@app.route('/api/stats')
+def get_stats():
+    """Scan counts by type, most-scanned contents and recent scan rates seen by this worker"""
+    scan_stats.sync(scan_history.clears)
+    top_n = max(1, min(request.args.get('top', 10, type=int), scan_stats.top_contents.capacity))
+    return jsonify(scan_stats.snapshot(top_n))
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    lines = [f'event: {event}']
+    if data and data.get('id') is not None:
+        lines.append(f"id: {data['id']}")
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/stream')
+def stream_scans():
+    """Push new scans and clears to the client as Server-Sent Events"""
+    # Subscribe before the response starts so no scan is missed
+    subscription = scan_events.subscribe(history_key(client_key()))
+
+    def events():
+        with subscription:
+            yield 'retry: 3000\n\n'
+            while True:
+                message = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                event, data = message
+                yield format_sse(event, data)
+                if event == 'dropped':
+                    return
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/export_history')
 def export_history():
-    """Export history as JSON"""
+    """Stream history as JSON, NDJSON or CSV, optionally filtered"""
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {fmt}'}), 400
+    try:
+        since = parse_time_arg('since')
+        until = parse_time_arg('until')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    types = set(filter(None, request.args.get('type', '').split(',')))
+
+    # Always streamed: exports are large, filtered per request and stamped
+    # with the time they were made, so caching them would not pay
+    records = filter_records(client_history(client_key()).iter_range(since, until), types)
+    chunks = stream_export(records, fmt, datetime.now().isoformat())
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt])
+    if fmt != 'json':
+        filename = f"qr_scan_history_{datetime.now().strftime('%Y-%m-%d')}.{fmt}"
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def parse_time_arg(name):
+    """Read a time query argument (epoch seconds or ISO timestamp) as epoch seconds"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f'Invalid {name} timestamp: {value}')
+
+@app.route('/metrics')
+def metrics():
+    """Request and history metrics in the Prometheus text format"""
+    gauges = [
+        ('qr_history_entries', 'gauge', 'Scans currently in history', len(scan_history)),
+        ('qr_history_bytes', 'gauge', 'Storage used by the history backend',
+         scan_history.bytes_used),
+        ('qr_history_evictions_total', 'counter', 'Scans dropped for capacity or retention',
+         scan_history.evictions),
+        ('qr_history_clients', 'gauge', 'Clients with their own history',
+         getattr(scan_history, 'partitions', None)),
+        ('qr_history_interned_strings', 'gauge', 'Distinct contents and types held in memory',
+         getattr(scan_history, 'interned', None)),
+        ('qr_response_cache_hits_total', 'counter', 'History views served from cache',
+         response_cache.hits),
+        ('qr_response_cache_misses_total', 'counter', 'History views built on request',
+         response_cache.misses),
+        ('qr_response_cache_bytes', 'gauge', 'Encoded history views held in the cache',
+         response_cache.bytes_used),
+        ('qr_stream_subscribers', 'gauge', 'Connected /api/stream clients', len(scan_events)),
+        ('qr_decode_pending', 'gauge', 'Images queued or decoding', decode_pool.pending),
+        ('qr_forward_sent_total', 'counter', 'Scans delivered to forwarding sinks',
+         sum(f.sent for f in forwarders) if forwarders else None),
+        ('qr_forward_dropped_total', 'counter', 'Scans lost to a full forwarding queue or spill limit',
+         sum(f.dropped for f in forwarders) if forwarders else None),
+        ('qr_forward_spilled_batches', 'gauge', 'Undelivered batches waiting on disk',
+         sum(f.spill_backlog for f in forwarders) if forwarders else None),
+        ('qr_rate_limited_total', 'counter', 'Requests refused by the rate limiter',
+         rate_limiter.limited if rate_limiter is not None else None),
+        ('qr_ingest_queued', 'gauge', 'Scans accepted and waiting to be saved',
+         ingest_queue.pending if ingest_queue is not None else None),
+        ('qr_ingest_rejected_total', 'counter', 'Scans refused because the ingest queue was full',
+         ingest_queue.rejected if ingest_queue is not None else None),
+        ('qr_ingest_failed_total', 'counter', 'Queued scans that could not be saved',
+         ingest_queue.failed if ingest_queue is not None else None),
+    ]
+    return Response(request_metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+def admin_allowed():
+    """Whether the caller holds ADMIN_TOKEN, or without one, connects from this host"""
+    if ADMIN_TOKEN is None:
+        return from_loopback()
+    supplied = request.headers.get('X-Admin-Token')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):]
+    return token_matches(supplied)
+
+@app.route('/admin/profile', methods=['GET', 'DELETE'])
+def profile_summary():
+    """Hottest functions per endpoint from sampled requests; DELETE resets"""
+    if profiler is None:
+        return jsonify({'error': 'Profiling is disabled; set PROFILING=1'}), 404
+    if not admin_allowed():
+        return jsonify({'error': 'Admin token required'}), 403
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({'success': True})
+
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f'sort must be one of {", ".join(SORT_KEYS)}'}), 400
+    try:
+        limit = max(1, int(request.args.get('limit', 20)))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     return jsonify({
-        'export_data': scan_history,
-        'export_time': datetime.now().isoformat(),
-        'total_scans': len(scan_history)
+        'sample_every': profiler.every,
+        'header': PROFILE_HEADER,
+        'endpoints': profiler.summary(request.args.get('endpoint'), limit, sort)
     })
 
 @app.route('/health')
@@ -63,598 +890,6 @@ def health_check():
     """Health check endpoint for monitoring"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
-# Create templates directory and HTML file when app starts
-def create_template():
-    os.makedirs('templates', exist_ok=True)
-    
-    html_template = '''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <meta http-equiv="Content-Security-Policy" content="upgrade-insecure-requests">
-    <title>QR Scanner Pro - Live Demo</title>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/qr-scanner/1.4.2/qr-scanner.umd.min.js"></script>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-
-        .container {
-            max-width: 600px;
-            margin: 0 auto;
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(20px);
-            border-radius: 20px;
-            padding: 30px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            border: 1px solid rgba(255, 255, 255, 0.2);
-        }
-
-        h1 {
-            color: white;
-            text-align: center;
-            margin-bottom: 10px;
-            font-size: 2.5em;
-            font-weight: 300;
-            text-shadow: 0 2px 10px rgba(0, 0, 0, 0.3);
-        }
-
-        .subtitle {
-            color: rgba(255, 255, 255, 0.8);
-            text-align: center;
-            margin-bottom: 30px;
-            font-size: 1.1em;
-        }
-
-        .scanner-container {
-            position: relative;
-            margin-bottom: 20px;
-            border-radius: 15px;
-            overflow: hidden;
-            box-shadow: 0 10px 25px rgba(0, 0, 0, 0.2);
-        }
-
-        #video {
-            width: 100%;
-            height: 300px;
-            object-fit: cover;
-            background: #000;
-        }
-
-        .scanner-overlay {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            width: 200px;
-            height: 200px;
-            border: 3px solid #00ff88;
-            border-radius: 20px;
-            box-shadow: 0 0 0 9999px rgba(0, 0, 0, 0.3);
-            animation: pulse 2s infinite;
-        }
-
-        @keyframes pulse {
-            0%, 100% { border-color: #00ff88; }
-            50% { border-color: #ff6b6b; }
-        }
-
-        .controls {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 20px;
-            justify-content: center;
-            flex-wrap: wrap;
-        }
-
-        button {
-            background: linear-gradient(45deg, #00ff88, #00cc6a);
-            color: white;
-            border: none;
-            padding: 12px 20px;
-            border-radius: 25px;
-            font-size: 14px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 15px rgba(0, 255, 136, 0.3);
-        }
-
-        button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 20px rgba(0, 255, 136, 0.4);
-        }
-
-        button:disabled {
-            background: #666;
-            cursor: not-allowed;
-            transform: none;
-            box-shadow: none;
-        }
-
-        .result-container {
-            background: rgba(255, 255, 255, 0.1);
-            border-radius: 15px;
-            padding: 20px;
-            margin-top: 20px;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-        }
-
-        .result-container h3 {
-            color: white;
-            margin-bottom: 15px;
-            font-size: 1.2em;
-        }
-
-        .result-text {
-            background: rgba(0, 0, 0, 0.2);
-            color: white;
-            padding: 15px;
-            border-radius: 10px;
-            word-break: break-all;
-            font-family: 'Courier New', monospace;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-            max-height: 100px;
-            overflow-y: auto;
-        }
-
-        .history {
-            max-height: 300px;
-            overflow-y: auto;
-            margin-top: 20px;
-        }
-
-        .history-item {
-            background: rgba(255, 255, 255, 0.05);
-            margin: 10px 0;
-            padding: 15px;
-            border-radius: 10px;
-            border-left: 4px solid #00ff88;
-            text-align: left;
-        }
-
-        .history-item .timestamp {
-            color: #ccc;
-            font-size: 12px;
-            margin-bottom: 8px;
-        }
-
-        .history-item .content {
-            color: white;
-            font-family: 'Courier New', monospace;
-            font-size: 14px;
-            word-break: break-all;
-        }
-
-        .history-item .type {
-            display: inline-block;
-            background: #00ff88;
-            color: black;
-            padding: 2px 8px;
-            border-radius: 12px;
-            font-size: 10px;
-            font-weight: bold;
-            margin-bottom: 8px;
-        }
-
-        .status {
-            color: white;
-            text-align: center;
-            margin: 15px 0;
-            font-weight: 500;
-            padding: 10px;
-            border-radius: 10px;
-            background: rgba(255, 255, 255, 0.1);
-        }
-
-        .error {
-            background: rgba(255, 107, 107, 0.2);
-            color: #ff6b6b;
-        }
-
-        .success {
-            background: rgba(0, 255, 136, 0.2);
-            color: #00ff88;
-        }
-
-        .stats {
-            display: flex;
-            justify-content: space-around;
-            margin: 20px 0;
-            color: white;
-        }
-
-        .stat {
-            text-align: center;
-        }
-
-        .stat-number {
-            font-size: 2em;
-            font-weight: bold;
-            color: #00ff88;
-        }
-
-        .notification {
-            position: fixed;
-            top: 20px;
-            right: 20px;
-            background: rgba(0, 255, 136, 0.9);
-            color: black;
-            padding: 15px 20px;
-            border-radius: 10px;
-            font-weight: bold;
-            transform: translateX(400px);
-            transition: transform 0.3s ease;
-            z-index: 1000;
-        }
-
-        .notification.show {
-            transform: translateX(0);
-        }
-
-        .footer {
-            text-align: center;
-            color: rgba(255, 255, 255, 0.7);
-            margin-top: 30px;
-            padding: 20px;
-            border-top: 1px solid rgba(255, 255, 255, 0.1);
-        }
-
-        .demo-badge {
-            display: inline-block;
-            background: rgba(255, 215, 0, 0.2);
-            color: #ffd700;
-            padding: 5px 12px;
-            border-radius: 15px;
-            font-size: 12px;
-            font-weight: bold;
-            margin-bottom: 20px;
-            border: 1px solid rgba(255, 215, 0, 0.3);
-        }
-
-        @media (max-width: 600px) {
-            .container {
-                padding: 20px;
-                margin: 10px;
-            }
-            
-            h1 {
-                font-size: 2em;
-            }
-            
-            #video {
-                height: 250px;
-            }
-            
-            .controls button {
-                padding: 10px 15px;
-                font-size: 12px;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="demo-badge">🚀 LIVE DEMO</div>
-        <h1>🔍 QR Scanner Pro</h1>
-        <div class="subtitle">Real-time QR code scanning with Flask backend</div>
-        
-        <div class="scanner-container">
-            <video id="video"></video>
-            <div class="scanner-overlay"></div>
-        </div>
-
-        <div class="controls">
-            <button id="startBtn">🎥 Start Scanner</button>
-            <button id="stopBtn" disabled>⏹️ Stop Scanner</button>
-            <button id="copyBtn" disabled>📋 Copy Result</button>
-            <button id="refreshHistory">🔄 Refresh History</button>
-            <button id="clearHistory">🗑️ Clear History</button>
-            <button id="exportData">📥 Export Data</button>
-        </div>
-
-        <div id="status" class="status">Ready to scan QR codes</div>
-
-        <div id="result" class="result-container" style="display: none;">
-            <h3>Latest Scan:</h3>
-            <div id="resultText" class="result-text"></div>
-        </div>
-
-        <div class="stats">
-            <div class="stat">
-                <div id="scanCount" class="stat-number">0</div>
-                <div>Total Scans</div>
-            </div>
-            <div class="stat">
-                <div id="sessionScans" class="stat-number">0</div>
-                <div>This Session</div>
-            </div>
-        </div>
-
-        <div class="result-container">
-            <h3>📜 Scan History</h3>
-            <div id="history" class="history">
-                <div style="color: #ccc; text-align: center; padding: 20px;">
-                    No scans yet. Start scanning to see history here!
-                </div>
-            </div>
-        </div>
-
-        <div class="footer">
-            <p>🎓 <strong>QR Scanner Pro</strong> - Built with Flask & JavaScript</p>
-            <p>✨ Features: Real-time scanning, History tracking, Export functionality</p>
-        </div>
-    </div>
-
-    <div id="notification" class="notification"></div>
-
-    <script>
-        let qrScanner = null;
-        let sessionScans = 0;
-        let currentResult = '';
-
-        const video = document.getElementById('video');
-        const startBtn = document.getElementById('startBtn');
-        const stopBtn = document.getElementById('stopBtn');
-        const copyBtn = document.getElementById('copyBtn');
-        const refreshHistoryBtn = document.getElementById('refreshHistory');
-        const clearHistoryBtn = document.getElementById('clearHistory');
-        const exportDataBtn = document.getElementById('exportData');
-        const status = document.getElementById('status');
-        const result = document.getElementById('result');
-        const resultText = document.getElementById('resultText');
-        const history = document.getElementById('history');
-        const scanCount = document.getElementById('scanCount');
-        const sessionScansEl = document.getElementById('sessionScans');
-        const notification = document.getElementById('notification');
-
-        // Initialize QR Scanner
-        async function initScanner() {
-            try {
-                qrScanner = new QrScanner(
-                    video,
-                    result => handleScanResult(result),
-                    {
-                        onDecodeError: err => {
-                            // Silently handle decode errors
-                        },
-                        highlightScanRegion: true,
-                        highlightCodeOutline: true,
-                        maxScansPerSecond: 3,
-                    }
-                );
-
-                updateStatus('✅ Scanner initialized. Click "Start Scanner" to begin.', 'success');
-                loadHistory();
-            } catch (err) {
-                updateStatus(`❌ Error initializing scanner: ${err.message}`, 'error');
-            }
-        }
-
-        async function handleScanResult(result) {
-            const scanData = {
-                content: result.data,
-                type: detectContentType(result.data),
-                timestamp: new Date().toISOString()
-            };
-
-            try {
-                const response = await fetch('/api/save_scan', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(scanData)
-                });
-
-                if (response.ok) {
-                    sessionScans++;
-                    currentResult = result.data;
-                    updateUI(scanData);
-                    loadHistory();
-                    showNotification('🎉 QR Code scanned and saved!');
-                    
-                    // Vibrate if supported
-                    if ('vibrate' in navigator) {
-                        navigator.vibrate(200);
-                    }
-                }
-            } catch (error) {
-                console.error('Error saving scan:', error);
-                showNotification('⚠️ Scan detected but failed to save', 'error');
-            }
-        }
-
-        function detectContentType(content) {
-            if (content.startsWith('http://') || content.startsWith('https://')) {
-                return 'URL';
-            } else if (content.startsWith('mailto:')) {
-                return 'Email';
-            } else if (content.startsWith('tel:')) {
-                return 'Phone';
-            } else if (content.startsWith('WIFI:')) {
-                return 'WiFi';
-            } else if (content.includes('@') && content.includes('.')) {
-                return 'Email';
-            } else {
-                return 'Text';
-            }
-        }
-
-        function updateUI(scanData) {
-            resultText.textContent = scanData.content;
-            result.style.display = 'block';
-            copyBtn.disabled = false;
-            
-            sessionScansEl.textContent = sessionScans;
-            updateStatus('✅ QR Code scanned successfully!', 'success');
-        }
-
-        async function loadHistory() {
-            try {
-                const response = await fetch('/api/history');
-                const data = await response.json();
-                
-                scanCount.textContent = data.total;
-                
-                if (data.history.length === 0) {
-                    history.innerHTML = `
-                        <div style="color: #ccc; text-align: center; padding: 20px;">
-                            📱 No scans yet. Start scanning to see history here!
-                        </div>
-                    `;
-                    return;
-                }
-                
-                history.innerHTML = data.history.map(item => `
-                    <div class="history-item">
-                        <div class="type">${item.type}</div>
-                        <div class="timestamp">⏰ ${new Date(item.timestamp).toLocaleString()}</div>
-                        <div class="content">${escapeHtml(item.content)}</div>
-                    </div>
-                `).join('');
-                
-            } catch (error) {
-                console.error('Error loading history:', error);
-                showNotification('❌ Failed to load history', 'error');
-            }
-        }
-
-        function updateStatus(message, type = '') {
-            status.textContent = message;
-            status.className = `status ${type}`;
-        }
-
-        function showNotification(message, type = 'success') {
-            notification.textContent = message;
-            notification.className = `notification ${type}`;
-            notification.classList.add('show');
-            
-            setTimeout(() => {
-                notification.classList.remove('show');
-            }, 3000);
-        }
-
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
-        }
-
-        // Event Listeners
-        startBtn.addEventListener('click', async () => {
-            try {
-                await qrScanner.start();
-                startBtn.disabled = true;
-                stopBtn.disabled = false;
-                updateStatus('🎥 Scanner active. Point camera at QR code.', 'success');
-            } catch (err) {
-                updateStatus(`❌ Error starting scanner: ${err.message}`, 'error');
-            }
-        });
-
-        stopBtn.addEventListener('click', () => {
-            qrScanner.stop();
-            startBtn.disabled = false;
-            stopBtn.disabled = true;
-            updateStatus('⏹️ Scanner stopped.', '');
-        });
-
-        copyBtn.addEventListener('click', async () => {
-            try {
-                await navigator.clipboard.writeText(currentResult);
-                showNotification('📋 Copied to clipboard!');
-                copyBtn.textContent = '✅ Copied!';
-                setTimeout(() => {
-                    copyBtn.textContent = '📋 Copy Result';
-                }, 2000);
-            } catch (err) {
-                showNotification('❌ Failed to copy to clipboard', 'error');
-            }
-        });
-
-        refreshHistoryBtn.addEventListener('click', () => {
-            loadHistory();
-            showNotification('🔄 History refreshed!');
-        });
-
-        clearHistoryBtn.addEventListener('click', async () => {
-            if (!confirm('🗑️ Are you sure you want to clear all scan history?')) {
-                return;
-            }
-            
-            try {
-                const response = await fetch('/api/history/clear', {
-                    method: 'DELETE'
-                });
-                
-                if (response.ok) {
-                    loadHistory();
-                    result.style.display = 'none';
-                    copyBtn.disabled = true;
-                    showNotification('🗑️ History cleared successfully!');
-                }
-            } catch (error) {
-                showNotification('❌ Failed to clear history', 'error');
-            }
-        });
-
-        exportDataBtn.addEventListener('click', async () => {
-            try {
-                const response = await fetch('/api/export_history');
-                const data = await response.json();
-                
-                const dataStr = JSON.stringify(data, null, 2);
-                const blob = new Blob([dataStr], { type: 'application/json' });
-                const url = window.URL.createObjectURL(blob);
-                
-                const link = document.createElement('a');
-                link.href = url;
-                link.download = `qr_scan_history_${new Date().toISOString().split('T')[0]}.json`;
-                document.body.appendChild(link);
-                link.click();
-                document.body.removeChild(link);
-                window.URL.revokeObjectURL(url);
-                
-                showNotification('📥 Data exported successfully!');
-            } catch (error) {
-                showNotification('❌ Failed to export data', 'error');
-            }
-        });
-
-        // Initialize on page load
-        window.addEventListener('load', initScanner);
-
-        // Handle page visibility changes
-        document.addEventListener('visibilitychange', () => {
-            if (document.hidden && qrScanner) {
-                qrScanner.stop();
-                startBtn.disabled = false;
-                stopBtn.disabled = true;
-                updateStatus('⏸️ Scanner paused (tab hidden).', '');
-            }
-        });
-    </script>
-</body>
-</html>'''
-    
-    # Write the HTML template
-    with open('templates/qr_scanner.html', 'w', encoding='utf-8') as f:
-        f.write(html_template)
-
-# Create template when app starts
-create_template()
-
 if __name__ == '__main__':
     # Production configuration
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,5 @@
+# benchmarks - Throughput and latency benchmarks for the QR Scanner API
+#
+#   python -m benchmarks micro --history-sizes 100,10000
+#   python -m benchmarks load --workers 1,4 --duration 10
+#   python -m benchmarks compare before.json after.json
@@ -0,0 +1,152 @@
+# __main__.py - Command line entry point: python -m benchmarks <mode> ...
+import argparse
+import json
+import sys
+
+from benchmarks import contention, loadgen, microbench
+from benchmarks.workload import DEFAULT_MIX, envelope, parse_mix, write_json
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def micro(args):
+    results = []
+    for size in args.history_sizes:
+        print(f'micro: history={size} backend={args.backend}', file=sys.stderr)
+        results.append(microbench.run_isolated(size, args.requests, args.mix, args.seed,
+                                               args.warmup, args.backend))
+    return results
+
+
+def load(args):
+    results = []
+    for workers in args.workers:
+        for size in args.history_sizes:
+            print(f'load: workers={workers} history={size} backend={args.backend}', file=sys.stderr)
+            results.append(loadgen.run(workers, size, args.mix, args.duration, args.warmup,
+                                       args.concurrency, args.threads, args.backend, args.seed))
+    return results
+
+
+def contend(args):
+    results = []
+    for store in args.stores:
+        for threads in args.threads:
+            print(f'contention: store={store} threads={threads}', file=sys.stderr)
+            results.append(contention.run(threads, args.seconds, args.writers,
+                                          args.history_size, store))
+    return results
+
+
+KEY_FIELDS = ('backend', 'store', 'workers', 'threads', 'writers', 'history_size')
+
+
+def result_key(result):
+    return tuple(result.get(name) for name in KEY_FIELDS)
+
+
+def result_label(result):
+    parts = [str(result.get('backend') or result.get('store'))]
+    parts += [f'{name}={result[name]}' for name in ('workers', 'threads', 'writers')
+              if result.get(name) is not None]
+    return ' '.join(parts + [f'history={result.get("history_size")}'])
+
+
+def summaries(result):
+    """(operation, summary) pairs to compare; contention results have one per operation kind"""
+    if 'rps' in result:
+        return [('', result)]
+    return [(kind, result[kind]) for kind in ('read', 'write') if result.get(kind)]
+
+
+def compare(args):
+    """Print throughput and tail latency changes between two result files"""
+    with open(args.before) as f:
+        before = {result_key(result): result for result in json.load(f)['results']}
+    with open(args.after) as f:
+        after = json.load(f)['results']
+    regressed = False
+    for result in after:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        previous = dict(summaries(old))
+        for kind, new in summaries(result):
+            prior = previous.get(kind)
+            if prior is None:
+                continue
+            rps_change = _change(prior['rps'], new['rps'])
+            p95_change = _change(prior['latency_ms']['p95'], new['latency_ms']['p95'])
+            label = f'{result_label(result)} {kind}'.strip()
+            print(f'{label:<50} rps {prior["rps"]} -> {new["rps"]} ({rps_change:+.1f}%)  '
+                  f'p95 {prior["latency_ms"]["p95"]} -> {new["latency_ms"]["p95"]} ms '
+                  f'({p95_change:+.1f}%)')
+            if rps_change < -args.threshold or p95_change > args.threshold:
+                regressed = True
+    return 1 if regressed else 0
+
+
+def _change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Throughput and latency benchmarks for the QR Scanner API')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    def common(sub, backend):
+        sub.add_argument('--history-sizes', type=int_list, default=[100, 10000],
+                         help='comma-separated history capacities to prefill')
+        sub.add_argument('--mix', default=DEFAULT_MIX,
+                         help='operation=weight pairs (default: %(default)s)')
+        sub.add_argument('--backend', default=backend, choices=('memory', 'shared', 'sqlite'))
+        sub.add_argument('--seed', type=int, default=0)
+        sub.add_argument('--output', '-o', help='write JSON here instead of stdout')
+
+    sub = modes.add_parser('micro', help='Flask test client, one process, no network')
+    common(sub, 'memory')
+    sub.add_argument('--requests', type=int, default=2000)
+    sub.add_argument('--warmup', type=int, default=100, help='requests before measuring')
+
+    sub = modes.add_parser('load', help='gunicorn on localhost driven by an async load generator')
+    common(sub, 'shared')
+    sub.add_argument('--workers', type=int_list, default=[1, 4], help='comma-separated worker counts')
+    sub.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    sub.add_argument('--concurrency', type=int, default=32, help='simultaneous connections')
+    sub.add_argument('--duration', type=float, default=10, help='seconds measured per run')
+    sub.add_argument('--warmup', type=float, default=2, help='seconds before measuring')
+
+    sub = modes.add_parser('contention', help='threads reading and writing the in-memory store')
+    sub.add_argument('--threads', type=int_list, default=[1, 2, 4, 8, 16])
+    sub.add_argument('--writers', type=int, help='writing threads (default: a quarter)')
+    sub.add_argument('--history-size', type=int, default=10000)
+    sub.add_argument('--seconds', type=float, default=2)
+    sub.add_argument('--stores', type=lambda text: text.split(','), default=['snapshot', 'locked'],
+                     help='snapshot (lock-free reads) and/or locked (reads take the lock)')
+    sub.add_argument('--output', '-o', help='write JSON here instead of stdout')
+
+    sub = modes.add_parser('compare', help='compare two result files; exits 1 on regression')
+    sub.add_argument('before')
+    sub.add_argument('after')
+    sub.add_argument('--threshold', type=float, default=10,
+                     help='percent drop in rps or rise in p95 counted as a regression')
+
+    args = parser.parse_args(argv)
+    if args.mode == 'compare':
+        return compare(args)
+    if args.mode == 'contention':
+        results = contend(args)
+    else:
+        parse_mix(args.mix)  # fail before starting anything
+        results = micro(args) if args.mode == 'micro' else load(args)
+    config = {name: value for name, value in vars(args).items() if name != 'output'}
+    write_json(envelope(args.mode, config, results), args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
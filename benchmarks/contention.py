@@ -0,0 +1,76 @@
+# contention.py - Concurrent readers and writers against the in-memory history
+import threading
+import time
+
+from benchmarks.workload import summarize
+from history_store import RingBufferHistory
+
+
+class LockedReadsHistory(RingBufferHistory):
+    """Baseline where reads take the writer lock, as a plain locked store would"""
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        with self._lock:
+            return super().page(before, limit, since, until)
+
+
+STORES = {'snapshot': RingBufferHistory, 'locked': LockedReadsHistory}
+
+
+def run(threads, seconds=2.0, writers=None, capacity=10000, store='snapshot', page_size=50):
+    """Hammer one store from `threads` threads, `writers` of which append
+
+    By default a quarter of the threads (at least one) write and the rest
+    read pages, which matches the read-heavy mix of the API.
+    """
+    history = STORES[store](capacity)
+    history.extend((f'prefill {i}', 'Text', time.time()) for i in range(capacity))
+    writers = max(1, threads // 4) if writers is None else writers
+    latencies = {'read': [], 'write': []}
+    stop = threading.Event()
+    start = threading.Barrier(threads + 1)
+
+    def reader(samples):
+        start.wait()
+        while not stop.is_set():
+            began = time.perf_counter()
+            history.page(limit=page_size)
+            samples.append(time.perf_counter() - began)
+
+    def writer(samples, n):
+        start.wait()
+        i = 0
+        while not stop.is_set():
+            began = time.perf_counter()
+            history.append(f'scan {n}-{i}', 'Text', time.time())
+            samples.append(time.perf_counter() - began)
+            i += 1
+
+    workers = []
+    for n in range(threads):
+        samples = []
+        if n < writers:
+            latencies['write'].append(samples)
+            workers.append(threading.Thread(target=writer, args=(samples, n)))
+        else:
+            latencies['read'].append(samples)
+            workers.append(threading.Thread(target=reader, args=(samples,)))
+    for worker in workers:
+        worker.start()
+    start.wait()
+    began = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - began
+
+    result = {'store': store, 'threads': threads, 'writers': writers,
+              'history_size': capacity}
+    total = 0
+    for kind, per_thread in latencies.items():
+        values = [value for samples in per_thread for value in samples]
+        total += len(values)
+        result[kind] = summarize(values, 0, elapsed) if values else None
+    result['ops_per_second'] = round(total / elapsed, 1)
+    return result
@@ -0,0 +1,181 @@
+# loadgen.py - Load tests against a locally launched gunicorn server
+import asyncio
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.workload import REPO_ROOT, Recorder, Workload, parse_mix, prefill_batches
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """gunicorn serving app:app on a free local port, run from a scratch directory"""
+
+    def __init__(self, workers=1, threads=8, history_size=100, backend='shared', env=None):
+        self.workers = workers
+        self.threads = threads
+        self.history_size = history_size
+        self.backend = backend
+        self.env = env or {}
+        self.port = free_port()
+        self._process = None
+        self._workdir = None
+
+    def __enter__(self):
+        self._workdir = tempfile.TemporaryDirectory(prefix='qr-bench-')
+        env = dict(os.environ,
+                   HISTORY_CAPACITY=str(self.history_size),
+                   HISTORY_BACKEND=self.backend,
+                   HISTORY_PATH=os.path.join(self._workdir.name, 'history'),
+                   FLASK_ENV='production',
+                   **self.env)
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn',
+             '--workers', str(self.workers),
+             '--worker-class', 'gthread', '--threads', str(self.threads),
+             '--bind', f'127.0.0.1:{self.port}',
+             '--chdir', self._workdir.name, '--pythonpath', REPO_ROOT,
+             '--log-level', 'warning', 'app:app'],
+            env=env
+        )
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            try:
+                status, _ = self.request('GET', '/health')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError('gunicorn did not become ready')
+
+    def request(self, method, path, body=None):
+        """One synchronous request, for setup rather than measurement"""
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            connection.request(method, path, payload, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def __exit__(self, *exc_info):
+        self._process.send_signal(signal.SIGTERM)
+        try:
+            self._process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._workdir.cleanup()
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client; handles Content-Length and chunked bodies"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self._writer is None:
+            await self._open()
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'Content-Length: {len(payload)}', 'Accept-Encoding: identity']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in response_headers:
+            await self._reader.readexactly(int(response_headers['content-length']))
+        else:
+            await self._reader.read()
+            self.close()
+            return status
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status
+
+
+async def _drive(port, workload, recorder, concurrency, duration):
+    deadline = time.monotonic() + duration
+
+    async def user():
+        connection = Connection('127.0.0.1', port)
+        try:
+            while time.monotonic() < deadline:
+                name, method, path, body, headers = workload.next()
+                started = time.perf_counter()
+                try:
+                    ok = await connection.request(method, path, body, headers) < 400
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    connection.close()
+                    ok = False
+                recorder.add(name, time.perf_counter() - started, ok)
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+
+def run(workers, history_size, mix, duration=10, warmup=2, concurrency=32, threads=8,
+        backend='shared', seed=0):
+    """Load a fresh server with `concurrency` closed-loop users for `duration` seconds"""
+    with Server(workers, threads, history_size, backend) as server:
+        for batch in prefill_batches(history_size):
+            server.request('POST', '/api/save_scans', batch)
+        workload = Workload(parse_mix(mix), seed)
+        if warmup:
+            asyncio.run(_drive(server.port, workload, Recorder(), concurrency, warmup))
+        recorder = Recorder()
+        started = time.perf_counter()
+        asyncio.run(_drive(server.port, workload, recorder, concurrency, duration))
+        result = recorder.result(time.perf_counter() - started)
+    result.update(workers=workers, threads=threads, history_size=history_size,
+                  backend=backend, concurrency=concurrency)
+    return result
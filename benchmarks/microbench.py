@@ -0,0 +1,72 @@
+# microbench.py - In-process benchmarks through the Flask test client
+#
+# Each configuration runs in a fresh interpreter, since the app reads its
+# history settings from the environment at import time.
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.workload import REPO_ROOT, Recorder, Workload, parse_mix, prefill_batches
+
+
+def send(client, method, path, body, headers):
+    if method == 'GET':
+        response = client.get(path, headers=headers)
+    else:
+        response = client.post(path, json=body, headers=headers)
+    # Read the whole body so streamed responses are fully generated
+    response.get_data()
+    return response.status_code < 400
+
+
+def run(history_size, requests, mix, seed=0, warmup=100):
+    """Measure `requests` requests against a history of `history_size` scans"""
+    import app
+
+    client = app.app.test_client()
+    for batch in prefill_batches(history_size):
+        client.post('/api/save_scans', json=batch)
+
+    workload = Workload(parse_mix(mix), seed)
+    for _ in range(warmup):
+        send(client, *workload.next()[1:])
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    for _ in range(requests):
+        name, method, path, body, headers = workload.next()
+        request_started = time.perf_counter()
+        ok = send(client, method, path, body, headers)
+        recorder.add(name, time.perf_counter() - request_started, ok)
+    return recorder.result(time.perf_counter() - started)
+
+
+def run_isolated(history_size, requests, mix, seed=0, warmup=100, backend='memory'):
+    """Run one configuration in a child interpreter and return its result"""
+    with tempfile.TemporaryDirectory(prefix='qr-bench-') as workdir:
+        env = dict(os.environ,
+                   HISTORY_CAPACITY=str(history_size),
+                   HISTORY_BACKEND=backend,
+                   HISTORY_PATH=os.path.join(workdir, 'history'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+        config = {'history_size': history_size, 'requests': requests, 'mix': mix,
+                  'seed': seed, 'warmup': warmup}
+        # Run from a scratch directory; the app writes files relative to its cwd
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.microbench', json.dumps(config)],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f'Benchmark run failed:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result.update(history_size=history_size, backend=backend)
+    return result
+
+
+if __name__ == '__main__':
+    config = json.loads(sys.argv[1])
+    result = run(**config)
+    sys.stdout.write('\n' + json.dumps(result) + '\n')
@@ -0,0 +1,172 @@
+# workload.py - Request mixes and latency summaries shared by both modes
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'save_scan=30,history=45,search=10,stats=5,export=5,save_scans=5'
+PREFILL_BATCH = 500
+CLIENTS = 50
+
+
+def parse_mix(text):
+    """Parse `name=weight,...` into a list of (name, weight)"""
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation {name!r}; choose from {", ".join(OPERATIONS)}')
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def _save_scan(rng, n):
+    return 'POST', '/api/save_scan', {'content': f'bench-{n}-{rng.random():.12f}'}
+
+
+def _save_scans(rng, n):
+    return 'POST', '/api/save_scans', [
+        {'content': f'bench-{n}-{i}-{rng.random():.12f}'} for i in range(20)
+    ]
+
+
+def _history(rng, n):
+    return 'GET', '/api/history?limit=50', None
+
+
+def _search(rng, n):
+    return 'GET', f'/api/history/search?q=prefill-{rng.randrange(1000)}', None
+
+
+def _stats(rng, n):
+    return 'GET', '/api/stats', None
+
+
+def _export(rng, n):
+    return 'GET', '/api/export_history?format=json', None
+
+
+OPERATIONS = {
+    'save_scan': _save_scan,
+    'save_scans': _save_scans,
+    'history': _history,
+    'search': _search,
+    'stats': _stats,
+    'export': _export,
+}
+
+
+class Workload:
+    """Deterministic stream of (operation, method, path, body, headers)
+
+    The same seed always yields the same sequence of requests, so runs
+    on different commits exercise identical traffic.
+    """
+
+    def __init__(self, mix, seed=0):
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.rng = random.Random(seed)
+        self.n = 0
+
+    def next(self):
+        self.n += 1
+        name = self.rng.choices(self.names, self.weights)[0]
+        method, path, body = OPERATIONS[name](self.rng, self.n)
+        headers = {'X-Client-ID': f'bench-{self.rng.randrange(CLIENTS)}'}
+        return name, method, path, body, headers
+
+
+def prefill_batches(size):
+    """Scans that fill the history to `size` before measuring"""
+    for start in range(0, size, PREFILL_BATCH):
+        yield [{'content': f'prefill-{i % 1000} item {i}'}
+               for i in range(start, min(size, start + PREFILL_BATCH))]
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """Latency percentiles (ms) and throughput for one set of samples"""
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(ordered, 0.50)),
+            'p95': ms(percentile(ordered, 0.95)),
+            'p99': ms(percentile(ordered, 0.99)),
+            'mean': ms(sum(ordered) / len(ordered)) if ordered else None,
+            'max': ms(ordered[-1]) if ordered else None
+        }
+    }
+
+
+class Recorder:
+    """Collects latencies per operation during a run"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, seconds, ok):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def result(self, elapsed):
+        every = [value for values in self.latencies.values() for value in values]
+        result = summarize(every, sum(self.errors.values()), elapsed)
+        result['duration_seconds'] = round(elapsed, 3)
+        result['operations'] = {
+            name: summarize(values, self.errors.get(name, 0), elapsed)
+            for name, values in sorted(self.latencies.items())
+        }
+        return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def envelope(mode, config, results):
+    """Wrap results with what is needed to compare them across commits"""
+    return {
+        'benchmark': 'qr-scanner',
+        'mode': mode,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': config,
+        'results': results
+    }
+
+
+def write_json(document, path):
+    text = json.dumps(document, indent=2)
+    if path in (None, '-'):
+        sys.stdout.write(text + '\n')
+    else:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
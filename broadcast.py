@@ -0,0 +1,85 @@
+# broadcast.py - Fan-out of live scan events to connected clients
+import queue
+import threading
+
+
+class Subscription:
+    """One subscriber's bounded event queue
+
+    A subscription with a `key` only receives events published for that
+    key or for everyone.
+    """
+
+    def __init__(self, broadcaster, max_queue, key=None):
+        self._broadcaster = broadcaster
+        self._queue = queue.Queue(max_queue)
+        self.key = key
+        self.dropped = False
+
+    def get(self, timeout=None):
+        """Return the next (event, data) pair, or None if nothing arrived in time"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broadcaster.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Broadcaster:
+    """Publishes events to every subscriber without ever blocking the publisher
+
+    Each subscriber gets a bounded queue. A subscriber that falls so far
+    behind that its queue is full is dropped instead of slowing down
+    save_scan; it receives a final `dropped` event and can reconnect.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, key=None):
+        subscription = Subscription(self, self.max_queue, key)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, data, key=None):
+        """Send to every subscriber, or only to those subscribed for `key`"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if key is not None and subscription.key is not None and subscription.key != key:
+                continue
+            try:
+                subscription._queue.put_nowait((event, data))
+            except queue.Full:
+                self._drop(subscription)
+
+    def _drop(self, subscription):
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        # Make room for the notice so the consumer learns why it stopped
+        try:
+            subscription._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscription._queue.put_nowait(('dropped', None))
+        except queue.Full:
+            pass
+
+    def __len__(self):
+        return len(self._subscribers)
@@ -0,0 +1,240 @@
+# classifier.py - Server-side content typing and parsing of scanned payloads
+import copy
+from functools import lru_cache
+from urllib.parse import parse_qs, unquote, urlsplit
+
+CACHE_SIZE = 4096
+# Longest payload memoized, the capacity of a QR code; longer ones are
+# parsed each time so the cache's memory stays bounded
+MAX_CACHED_LENGTH = 4296
+
+
+def _query_fields(query):
+    return {key: values[0] for key, values in parse_qs(query).items()}
+
+
+def _split_escaped(text, separator):
+    """Split on `separator`, honouring backslash escapes (WIFI/MECARD syntax)"""
+    parts = []
+    current = []
+    escaped = False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == separator:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _key_values(body):
+    """Parse `K:value;K:value;;` records used by WIFI: and MECARD:"""
+    fields = {}
+    for part in _split_escaped(body, ';'):
+        key, sep, value = part.partition(':')
+        if sep:
+            fields.setdefault(key.upper(), []).append(value)
+    return fields
+
+
+def _parse_url(content, rest):
+    try:
+        parts = urlsplit(content)
+        host = parts.hostname or ''
+    except ValueError:
+        # Malformed netloc such as 'http://[x'; still a scan worth keeping
+        return 'Text', {}
+    fields = {'scheme': parts.scheme.lower(), 'host': host, 'path': parts.path}
+    if parts.query:
+        fields['query'] = _query_fields(parts.query)
+    return 'URL', fields
+
+
+def _parse_mailto(content, rest):
+    address, _, query = rest.partition('?')
+    fields = {'to': unquote(address)}
+    fields.update(_query_fields(query))
+    return 'Email', fields
+
+
+def _parse_tel(content, rest):
+    return 'Phone', {'number': rest.strip()}
+
+
+def _parse_sms(content, rest):
+    # sms:+123?body=hi and SMSTO:+123:hi
+    if '?' in rest:
+        number, _, query = rest.partition('?')
+        fields = {'number': number}
+        fields.update(_query_fields(query))
+    else:
+        number, _, message = rest.partition(':')
+        fields = {'number': number}
+        if message:
+            fields['body'] = message
+    return 'SMS', fields
+
+
+def _parse_geo(content, rest):
+    coordinates, _, query = rest.partition('?')
+    values = coordinates.split(',')
+    try:
+        fields = {'latitude': float(values[0]), 'longitude': float(values[1])}
+        if len(values) > 2:
+            fields['altitude'] = float(values[2])
+    except (ValueError, IndexError):
+        return 'Text', {}
+    fields.update(_query_fields(query))
+    return 'Geo', fields
+
+
+def _parse_wifi(content, rest):
+    values = _key_values(rest)
+    first = lambda key: values.get(key, [''])[0]
+    return 'WiFi', {
+        'ssid': first('S'),
+        'security': first('T') or 'nopass',
+        'password': first('P'),
+        'hidden': first('H').lower() == 'true'
+    }
+
+
+def _parse_mecard(content, rest):
+    values = _key_values(rest)
+    fields = {'name': values.get('N', [''])[0].replace(',', ' ').strip()}
+    for key, name in (('TEL', 'phones'), ('EMAIL', 'emails'), ('URL', 'urls')):
+        if key in values:
+            fields[name] = values[key]
+    for key, name in (('ADR', 'address'), ('ORG', 'organization'), ('NOTE', 'note')):
+        if key in values:
+            fields[name] = values[key][0]
+    return 'MeCard', fields
+
+
+def _parse_vcard(content, rest):
+    fields = {}
+    for line in content.replace('\r\n', '\n').split('\n'):
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name = key.split(';', 1)[0].upper()
+        if name == 'FN':
+            fields['name'] = value
+        elif name == 'N' and 'name' not in fields:
+            fields['name'] = ' '.join(part for part in reversed(value.split(';')) if part)
+        elif name == 'TEL':
+            fields.setdefault('phones', []).append(value)
+        elif name == 'EMAIL':
+            fields.setdefault('emails', []).append(value)
+        elif name == 'URL':
+            fields.setdefault('urls', []).append(value)
+        elif name == 'ORG':
+            fields['organization'] = value.replace(';', ' ').strip()
+    return 'vCard', fields
+
+
+EPC_FIELDS = ('service', 'version', 'charset', 'identification', 'bic', 'name',
+              'iban', 'amount', 'purpose', 'reference', 'text')
+
+
+def _parse_epc(content, rest):
+    # European Payments Council QR (SEPA credit transfer), one field per line
+    lines = content.replace('\r\n', '\n').split('\n')
+    fields = {name: value.strip() for name, value in zip(EPC_FIELDS, lines) if value.strip()}
+    amount = fields.get('amount', '')
+    if amount[:3].isalpha():
+        fields['currency'] = amount[:3]
+        fields['amount'] = amount[3:]
+    for name in ('service', 'version', 'charset', 'identification'):
+        fields.pop(name, None)
+    return 'Payment', fields
+
+
+def _parse_bitcoin(content, rest):
+    address, _, query = rest.partition('?')
+    fields = {'currency': 'BTC', 'address': address}
+    fields.update(_query_fields(query))
+    return 'Payment', fields
+
+
+# Lower-cased scheme (text before the first ':') -> parser
+SCHEMES = {
+    'http': _parse_url,
+    'https': _parse_url,
+    'mailto': _parse_mailto,
+    'tel': _parse_tel,
+    'sms': _parse_sms,
+    'smsto': _parse_sms,
+    'geo': _parse_geo,
+    'wifi': _parse_wifi,
+    'mecard': _parse_mecard,
+    'bitcoin': _parse_bitcoin,
+}
+
+MAX_SCHEME_LENGTH = max(len(scheme) for scheme in SCHEMES)
+
+
+def _looks_like_email(content):
+    if content.count('@') != 1 or any(char.isspace() for char in content):
+        return False
+    local, _, domain = content.partition('@')
+    return bool(local) and '.' in domain.strip('.')
+
+
+def _parse(parser, content, rest):
+    # Scans are arbitrary text, so a payload a parser chokes on is plain Text
+    try:
+        return parser(content, rest)
+    except ValueError:
+        return 'Text', {}
+
+
+def _classify(content):
+    stripped = content.lstrip()
+    # One dictionary lookup on the scheme decides which parser runs
+    colon = stripped.find(':', 0, MAX_SCHEME_LENGTH + 1)
+    if colon > 0:
+        scheme = stripped[:colon].lower()
+        parser = SCHEMES.get(scheme)
+        if scheme == 'begin' and stripped[colon + 1:colon + 6].upper() == 'VCARD':
+            parser = _parse_vcard
+        if parser is not None:
+            return _parse(parser, stripped, stripped[colon + 1:])
+    if stripped.startswith('BCD\n') or stripped.startswith('BCD\r\n'):
+        return _parse(_parse_epc, stripped, stripped)
+    if _looks_like_email(stripped):
+        return 'Email', {'to': stripped}
+    return 'Text', {}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _classify_cached(content):
+    return _classify(content)
+
+
+def classify(content):
+    """Return (type, fields) for a scanned payload
+
+    Results for payloads up to MAX_CACHED_LENGTH are memoized in a
+    bounded LRU, since the same codes are scanned over and over; callers
+    get their own copy of the fields.
+    """
+    if len(content) > MAX_CACHED_LENGTH:
+        return _classify(content)
+    scan_type, fields = _classify_cached(content)
+    return scan_type, copy.deepcopy(fields)
+
+
+def classify_many(contents):
+    return [classify(content) for content in contents]
+
+
+def cache_info():
+    return _classify_cached.cache_info()
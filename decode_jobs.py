@@ -0,0 +1,240 @@
+# decode_jobs.py - Background decoding of ZIP archives of label photos
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from qr_decode import DecodeError, DecoderBusy
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMBER_BYTES = 32 * 1024 * 1024  # uncompressed; larger members are skipped
+MAX_REPORTED_ERRORS = 100
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are already waiting; the caller should retry later"""
+
+
+def image_members(archive):
+    """Archive entries worth decoding, skipping folders and OS metadata"""
+    for info in archive.infolist():
+        name = info.filename
+        base = name.rsplit('/', 1)[-1]
+        if info.is_dir() or name.startswith('__MACOSX/') or base.startswith('.'):
+            continue
+        yield info
+
+
+class DecodeJob:
+    """Progress of one archive; only counters and the first errors are kept"""
+
+    def __init__(self, path, filename=None, owner=None):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.filename = filename
+        self.owner = owner
+        self.status = 'queued'
+        self.members = 0
+        self.processed = 0
+        self.decoded = 0
+        self.saved = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.errors = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+
+    def add_error(self, member, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'member': member, 'error': message})
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'members': self.members,
+            'processed': self.processed,
+            'decoded': self.decoded,
+            'saved': self.saved,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'elapsed_seconds': round(elapsed, 3),
+            'images_per_second': round(self.processed / elapsed, 2) if elapsed else 0,
+            'error': self.error,
+            'errors': list(self.errors)
+        }
+
+
+class JobManager:
+    """Runs archive jobs against a DecodePool and saves results in batches
+
+    Members are read from the archive only when a decode slot is free, so
+    at most `max_in_flight` images are held in memory per job whatever
+    the archive size. Decoded contents are passed to `save_batch(contents,
+    job)`, which returns how many were saved, every `batch_size` codes.
+    `max_running` worker threads decode one job each; up to `max_queued`
+    more wait as `queued`, and `submit` refuses jobs beyond that.
+    Finished jobs are remembered up to `max_jobs`.
+
+    The workers are started per process on first use, since threads do
+    not survive a gunicorn fork.
+    """
+
+    def __init__(self, pool, save_batch, batch_size=100, max_in_flight=None,
+                 max_running=2, max_jobs=100, max_queued=16):
+        self.pool = pool
+        self.save_batch = save_batch
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight or pool.workers * 2
+        self.max_running = max_running
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue(max_queued)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def full(self):
+        """Whether a job submitted now would be refused"""
+        return self._queue.full()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for n in range(self.max_running):
+                threading.Thread(target=self._work, name=f'decode-job-{n}', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, path, filename=None, owner=None):
+        """Queue the archive at `path`, deleted once decoded; raises JobQueueFull"""
+        self._ensure_started()
+        job = DecodeJob(path, filename, owner)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise JobQueueFull(f'{self.max_queued} decode jobs are already waiting')
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        return job
+
+    def _work(self):
+        while True:
+            self._run(self._queue.get())
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None and not job.done:
+            job.cancelled = True
+        return job
+
+    def _run(self, job):
+        job.started = time.time()
+        job.status = 'running'
+        try:
+            with zipfile.ZipFile(job.path) as archive:
+                self._decode_archive(job, archive)
+            job.status = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            logger.exception('Decode job %s failed', job.id)
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            job.in_flight = 0
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass
+
+    def _decode_archive(self, job, archive):
+        members = list(image_members(archive))
+        job.members = len(members)
+        pending = iter(members)
+        in_flight = {}  # future -> member name
+        held = None     # (name, data) refused by a busy pool, submitted next
+        batch = []
+        exhausted = False
+
+        while in_flight or not exhausted:
+            # Top up the window, reading each member only when it is submitted
+            while not job.cancelled and len(in_flight) < self.max_in_flight:
+                if held is None:
+                    info = next(pending, None)
+                    if info is None:
+                        exhausted = True
+                        break
+                    if info.file_size > MAX_MEMBER_BYTES:
+                        job.processed += 1
+                        job.add_error(info.filename, 'Image is too large')
+                        continue
+                    held = (info.filename, archive.read(info))
+                try:
+                    future = self.pool.submit(held[1])
+                except DecoderBusy:
+                    if in_flight:
+                        break  # collect our own results first
+                    time.sleep(0.05)  # other requests hold every slot
+                    continue
+                in_flight[future] = held[0]
+                held = None
+            if job.cancelled and not in_flight:
+                break
+            job.in_flight = len(in_flight)
+            if not in_flight:
+                continue
+
+            timeout = max(0, min(future.deadline for future in in_flight) - time.monotonic())
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in [f for f in in_flight if f in done or f.deadline <= now]:
+                member = in_flight.pop(future)
+                job.processed += 1
+                try:
+                    codes = self.pool.result(future)
+                except DecodeError as e:
+                    job.add_error(member, str(e))
+                    continue
+                if not codes:
+                    job.add_error(member, 'No QR code found')
+                    continue
+                job.decoded += len(codes)
+                batch.extend(code['content'] for code in codes)
+            if len(batch) >= self.batch_size:
+                job.saved += self.save_batch(batch, job)
+                batch = []
+
+        if batch:
+            job.saved += self.save_batch(batch, job)
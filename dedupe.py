@@ -0,0 +1,64 @@
+# dedupe.py - Suppression of repeated scans of the same code
+import threading
+from collections import OrderedDict
+
+
+class DuplicateFilter:
+    """Remembers recent scans per (content, client) for a sliding window
+
+    A repeat arriving within `window` seconds of the previous scan of the
+    same code from the same client maps to the existing history record,
+    and each repeat extends the window. Entries are kept in LRU order,
+    which is also last-seen order, so expired and excess entries are
+    evicted from the front.
+    """
+
+    def __init__(self, window=5.0, max_entries=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (content, client) -> [record, last_seen]
+        self._lock = threading.Lock()
+
+    def check(self, content, client, now):
+        """Return the record a repeat scan should count against, if any"""
+        if self.window <= 0:
+            return None
+        key = (content, client)
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[1] = now
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def remember(self, content, client, record, now):
+        if self.window <= 0:
+            return
+        with self._lock:
+            self._entries[(content, client)] = [record, now]
+            self._entries.move_to_end((content, client))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            key, (_, last_seen) = next(iter(entries.items()))
+            if now - last_seen <= self.window:
+                break
+            del entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def forget(self, client):
+        """Drop every entry for one client"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == client]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,398 @@
+# forwarding.py - Batched delivery of saved scans to downstream systems
+import glob
+import gzip
+import hashlib
+import http.client
+import http.server
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class SinkError(Exception):
+    """A batch could not be delivered; it may succeed on a later attempt"""
+
+
+def encode_batch(events):
+    """Gzip-compressed NDJSON, one event per line"""
+    lines = ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+    return gzip.compress(lines.encode('utf-8'), compresslevel=6)
+
+
+class WebhookSink:
+    """POSTs batches to an HTTP(S) endpoint over one kept-alive connection
+
+    Bodies are gzip-compressed NDJSON (`Content-Encoding: gzip`); any 2xx
+    answer counts as delivered. The connection is reused across batches
+    and reopened after an error or when the server closed it.
+    """
+
+    def __init__(self, url, timeout=10, headers=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported webhook URL: {url}')
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._https = parts.scheme == 'https'
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        self._connection = None
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        return connection_class(self._host, self._port, timeout=self.timeout)
+
+    def send(self, payload):
+        headers = dict(self.headers, **{
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+        })
+        # A reused connection the server has since closed fails at once;
+        # that attempt is repeated on a fresh connection
+        for reused in (self._connection is not None, False):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request('POST', self._path, payload, headers)
+                response = self._connection.getresponse()
+                response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                self.close()
+                if reused:
+                    continue
+                raise SinkError(f'{self.url}: {e}')
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                raise SinkError(f'{self.url}: {e}')
+            if response.will_close:
+                self.close()
+            if not 200 <= response.status < 300:
+                raise SinkError(f'{self.url}: HTTP {response.status}')
+            return
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class FileSink:
+    """Appends each batch to a local file as one gzip member
+
+    Concatenated gzip members form a valid gzip stream, so the file reads
+    back with `zcat` or `gzip.open` as one NDJSON document.
+    """
+
+    def __init__(self, path):
+        self.url = path
+        self.path = path
+
+    def send(self, payload):
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            raise SinkError(f'{self.path}: {e}')
+
+    def close(self):
+        pass
+
+
+def open_sink(target, timeout=10):
+    """A sink for an http(s) URL, or a file path (optionally `file:` prefixed)"""
+    if target.startswith(('http://', 'https://')):
+        return WebhookSink(target, timeout)
+    if target.startswith('file:'):
+        target = target[len('file:'):]
+    return FileSink(target)
+
+
+class Forwarder:
+    """Ships saved scans to one sink in compressed batches
+
+    `submit` never blocks the caller: events go on a bounded queue that a
+    thread drains into batches of `batch_size`, or smaller ones once the
+    oldest queued event is `flush_seconds` old. A failed batch is retried
+    `max_retries` times with exponential backoff and jitter, then written
+    to `spill_dir`. While the sink keeps failing, new batches go straight
+    to disk; the oldest spilled batch is retried as a probe with growing
+    backoff, and once one is accepted the rest are replayed. Delivery is
+    at least once and batches may arrive out of order.
+
+    Spill files are claimed by renaming, so forwarders in several workers
+    can share one directory. Beyond `max_spill_bytes` the oldest spilled
+    batches are discarded. Events submitted when the queue is full are
+    counted in `dropped`.
+    """
+
+    def __init__(self, sink, spill_dir, batch_size=500, flush_seconds=5, max_queue=10000,
+                 max_retries=3, backoff=0.5, max_backoff=60, max_spill_bytes=100 * 1024 * 1024):
+        self.sink = sink
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_spill_bytes = max_spill_bytes
+        self.sent = 0      # events delivered
+        self.spilled = 0   # events written to disk
+        self.dropped = 0   # events lost to a full queue or the spill limit
+        self._queue = queue.Queue(max_queue)
+        self._healthy = True
+        self._probe_delay = backoff
+        self._next_probe = 0.0
+        self._closed = False
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._recover_claims()
+            threading.Thread(target=self._run, name='scan-forwarder', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        """Wait for the next batch; empty if nothing arrived for a flush interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size and not self._closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                if batch:
+                    self._deliver(batch)
+                self._replay()
+            except Exception:
+                logger.exception('Forwarding to %s failed', self.sink.url)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch):
+        payload = encode_batch(batch)
+        if self._healthy:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.sink.send(payload)
+                    self.sent += len(batch)
+                    return
+                except SinkError as e:
+                    logger.warning('Forwarding %d scans failed (attempt %d): %s',
+                                   len(batch), attempt + 1, e)
+                if attempt < self.max_retries:
+                    delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+            self._mark_failing()
+        self._spill(payload, len(batch))
+
+    def _mark_failing(self):
+        self._healthy = False
+        self._probe_delay = self.backoff
+        self._next_probe = time.monotonic() + self._probe_delay
+
+    def _spill_files(self):
+        return sorted(glob.glob(os.path.join(self.spill_dir, '*.ndjson.gz')))
+
+    def _recover_claims(self):
+        """Put back spilled batches claimed by processes that died mid-send"""
+        for claimed in glob.glob(os.path.join(self.spill_dir, '*.sending')):
+            path, pid, _ = claimed.rsplit('.', 2)
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except (PermissionError, ValueError):
+                continue
+            try:
+                os.rename(claimed, path)
+            except FileNotFoundError:
+                pass
+
+    def _spill(self, payload, count):
+        # Named by time so sorting the directory replays oldest first
+        name = f'{time.time():017.6f}-{count}-{uuid.uuid4().hex[:8]}.ndjson.gz'
+        path = os.path.join(self.spill_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+        self.spilled += count
+        self._trim_spill()
+
+    def _trim_spill(self):
+        files = []
+        for path in self._spill_files():
+            try:
+                files.append((path, os.path.getsize(path)))
+            except FileNotFoundError:
+                pass  # replayed by another worker meanwhile
+        total = sum(size for _, size in files)
+        for path, size in files:
+            if total <= self.max_spill_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # replayed by another worker meanwhile
+            total -= size
+            self.dropped += _spilled_count(path)
+            logger.warning('Spill limit reached; discarded %s', os.path.basename(path))
+
+    def _replay(self):
+        """Retry spilled batches: one probe while failing, all of them once healthy"""
+        while True:
+            if not self._healthy and time.monotonic() < self._next_probe:
+                return
+            files = self._spill_files()
+            if not files:
+                self._healthy = True
+                return
+            claimed = f'{files[0]}.{os.getpid()}.sending'
+            try:
+                os.rename(files[0], claimed)
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            with open(claimed, 'rb') as f:
+                payload = f.read()
+            try:
+                self.sink.send(payload)
+            except SinkError as e:
+                os.rename(claimed, files[0])
+                self._healthy = False
+                self._probe_delay = min(self.max_backoff, self._probe_delay * 2)
+                self._next_probe = time.monotonic() + self._probe_delay
+                logger.warning('Replaying spilled scans failed: %s', e)
+                return
+            os.remove(claimed)
+            self.sent += _spilled_count(files[0])
+            self._healthy = True
+            if self._closed or not self._queue.empty():
+                return  # new scans first; the rest on the next pass
+
+    @property
+    def spill_backlog(self):
+        return len(self._spill_files())
+
+    def close(self, timeout=None):
+        """Deliver what is queued, spilling whatever is left after `timeout`"""
+        self._closed = True
+        if self._pid == os.getpid():
+            deadline = None if timeout is None else time.monotonic() + timeout
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._queue.all_tasks_done.wait(remaining)
+        # No consumer, or it ran out of time: straight to disk for the next start
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            self._spill(encode_batch(chunk), len(chunk))
+        self.sink.close()
+
+
+def _spilled_count(path):
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def spill_dir_for(base, target):
+    """A spill directory of its own for each sink under `base`"""
+    return os.path.join(base, hashlib.sha1(target.encode('utf-8')).hexdigest()[:12])
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts forwarded batches and appends their events to a file"""
+
+    protocol_version = 'HTTP/1.1'  # keep connections alive like a real webhook
+
+    def do_POST(self):
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.fail_every and self.server.requests % self.server.fail_every == 0:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with self.server.lock:
+            with open(self.server.output, 'ab') as f:
+                f.write(body)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stand_in(port, output, fail_every=0):
+    """Run a local webhook receiver for trying out forwarding"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _StandInHandler)
+    server.output = output
+    server.fail_every = fail_every
+    server.requests = 0
+    server.lock = threading.Lock()
+    print(f'Receiving on http://127.0.0.1:{port}/ into {output}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Stand-in webhook that writes forwarded scans to an NDJSON file')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--output', default='forwarded.ndjson')
+    parser.add_argument('--fail-every', type=int, default=0,
+                        help='answer every Nth batch with 503 to exercise retries')
+    args = parser.parse_args()
+    serve_stand_in(args.port, args.output, args.fail_every)
@@ -0,0 +1,76 @@
+# history_export.py - Streaming export of scan history
+import csv
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+FIELDS = ('id', 'content', 'type', 'timestamp', 'count')
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def filter_records(records, types=None):
+    """Yield the records whose type is in `types` (all of them if empty)"""
+    for record in records:
+        if types and record.type not in types:
+            continue
+        yield record
+
+
+def _chunked(pieces):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _json_pieces(records, export_time):
+    yield '{"export_data": ['
+    total = 0
+    for record in records:
+        yield (',' if total else '') + json.dumps(record.to_dict())
+        total += 1
+    yield '], "export_time": %s, "total_scans": %d}' % (json.dumps(export_time), total)
+
+
+def _ndjson_pieces(records):
+    for record in records:
+        yield json.dumps(record.to_dict()) + '\n'
+
+
+def _csv_pieces(records):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow((record.id, record.content, record.type, record.timestamp, record.count))
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    # Only the header is left over when there were no records
+    if line.getvalue():
+        yield line.getvalue()
+
+
+def stream_export(records, fmt, export_time):
+    """Encode records in the requested format as a stream of text chunks"""
+    if fmt == 'json':
+        pieces = _json_pieces(records, export_time)
+    elif fmt == 'ndjson':
+        pieces = _ndjson_pieces(records)
+    elif fmt == 'csv':
+        pieces = _csv_pieces(records)
+    else:
+        raise ValueError(f'Unsupported export format: {fmt}')
+    return _chunked(pieces)
@@ -0,0 +1,391 @@
+# history_store.py - Scan history storage for the QR Scanner app
+import bisect
+import os
+import socket
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from itertools import islice
+
+
+class ScanRecord:
+    """A single saved scan"""
+
+    __slots__ = ('id', 'content', 'type', 'created', 'count')
+
+    def __init__(self, id, content, type, created, count=1):
+        self.id = id
+        self.content = content
+        self.type = type
+        self.created = created  # epoch seconds
+        self.count = count  # times scanned, including repeats folded into it
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.created).isoformat()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content': self.content,
+            'type': self.type,
+            'timestamp': self.timestamp,
+            'created': self.created,
+            'count': self.count
+        }
+
+
+class HistoryStore:
+    """Interface shared by the scan history backends
+
+    Iteration always yields records newest-first. Record ids increase
+    monotonically and are never reused, even after a clear, and `created`
+    never decreases with the id, so id order is also time order.
+
+    Backends also expose `bytes_used`, the storage they occupy,
+    `evictions`, the records dropped for capacity or retention, `clears`,
+    how many times it has been cleared by any process sharing it, and
+    `store_id`, naming the id sequence their records belong to: two
+    records with the same id and store_id are the same scan.
+    """
+
+    def append(self, content, type, created):
+        raise NotImplementedError
+
+    def extend(self, scans):
+        """Append (content, type, created) tuples in order"""
+        return [self.append(*scan) for scan in scans]
+
+    def increment(self, record, by=1):
+        """Count repeat scans against an existing record"""
+        raise NotImplementedError
+
+    def contains(self, record):
+        """Whether `record` is still held, not evicted, expired or cleared"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def compact(self, min_created=None, max_bytes=None):
+        """Drop the oldest records older than `min_created` or beyond `max_bytes`"""
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    @property
+    def version(self):
+        """Opaque string that changes whenever the history changes"""
+        raise NotImplementedError
+
+    @property
+    def store_id(self):
+        raise NotImplementedError
+
+    def iter_range(self, since=None, until=None, before=None):
+        """Yield records created in [since, until] with an id below `before`, newest first"""
+        for record in self:
+            if before is not None and record.id >= before:
+                continue
+            if until is not None and record.created > until:
+                continue
+            if since is not None and record.created < since:
+                return
+            yield record
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        """Return up to `limit` records from iter_range"""
+        return list(islice(self.iter_range(since, until, before), limit))
+
+    def latest(self, limit):
+        """Return up to `limit` of the newest records as dicts"""
+        return [record.to_dict() for record in self.page(limit=limit)]
+
+    def to_list(self):
+        """Return every record as a dict, newest first"""
+        return [record.to_dict() for record in self]
+
+    def add_listener(self, listener):
+        """Report records entering and leaving this process's history
+
+        The listener's on_append(record), on_evict(record) and on_clear()
+        are called after each change. Only backends whose writes all
+        happen in this process can offer this.
+        """
+        raise NotImplementedError
+
+
+# Memory held per stored record beyond its strings: the ScanRecord itself
+# plus its id and created objects (small counts are cached by CPython)
+RECORD_SIZE = sys.getsizeof(ScanRecord(1 << 30, '', '', 0.0)) + sys.getsizeof(0.0) + sys.getsizeof(1 << 30)
+# Per distinct string in a StringTable: its [string, refs] pair and dict slot
+STRING_ENTRY_SIZE = sys.getsizeof([None, 0]) + 48
+
+
+class StringTable:
+    """Refcounted table that stores each distinct string once
+
+    `add` returns the table's copy of an equal string, so every record
+    with the same content shares one object; `release` drops a reference
+    and forgets the string with its last one. `bytes_used` is the memory
+    held by the distinct strings and their entries. Not thread-safe; the
+    owning store calls it under its write lock.
+    """
+
+    def __init__(self):
+        self.bytes_used = 0
+        self.references = 0
+        self._entries = {}  # string -> [string, refs]
+
+    def add(self, value):
+        entry = self._entries.get(value)
+        if entry is None:
+            entry = self._entries[value] = [value, 0]
+            self.bytes_used += sys.getsizeof(value) + STRING_ENTRY_SIZE
+        entry[1] += 1
+        self.references += 1
+        return entry[0]
+
+    def release(self, value):
+        entry = self._entries[value]
+        entry[1] -= 1
+        self.references -= 1
+        if not entry[1]:
+            del self._entries[value]
+            self.bytes_used -= sys.getsizeof(value) + STRING_ENTRY_SIZE
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RingBufferHistory(HistoryStore):
+    """Fixed-capacity history backed by a preallocated ring buffer
+
+    Appends overwrite the oldest slot once the buffer is full, so writes
+    are O(1) regardless of capacity. The record with id N always lives in
+    slot (N - 1) % capacity, so pages and time ranges are located by
+    arithmetic and bisection instead of scanning.
+
+    Writers serialize on a lock; readers never take it. Each write ends by
+    publishing a (slots, next id, size) tuple, which a reader picks up in
+    a single attribute read, and every slot it then reads is checked
+    against the id it expects. A slot overwritten after the snapshot was
+    taken only ever holds one of the oldest records, so a reader stops
+    there and returns a consistent, possibly slightly shorter, page.
+
+    Contents and types go through a StringTable, so repeated payloads are
+    held once. `bytes_used` is the buffer's estimated memory footprint:
+    the slot list, the records and the distinct strings. With `max_bytes`
+    set, each append drops the oldest records until it fits that budget.
+    Ids start at `first_id`, so a buffer replacing another can carry on
+    its numbering.
+    """
+
+    def __init__(self, capacity=100, max_bytes=None, first_id=1):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.clears = 0
+        self._strings = StringTable()
+        self._slots = [None] * capacity
+        self._next_id = first_id
+        self._size = 0
+        self._writes = 0
+        self._last_created = 0.0
+        self._lock = threading.Lock()
+        # Distinguishes this process's history from other workers' in ETags
+        self._token = uuid.uuid4().hex[:8]
+        self._listeners = []
+        self._publish()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    @property
+    def bytes_used(self):
+        return sys.getsizeof(self._slots) + RECORD_SIZE * self._size + self._strings.bytes_used
+
+    @property
+    def interned(self):
+        """Distinct content and type strings held"""
+        return len(self._strings)
+
+    @property
+    def next_id(self):
+        """The id the next appended record will get"""
+        return self._view[1]
+
+    def _publish(self):
+        self._view = (self._slots, self._next_id, self._size)
+
+    def _slot(self, record_id):
+        return self._slots[(record_id - 1) % self.capacity]
+
+    def _evict_oldest(self):
+        index = (self._next_id - self._size - 1) % self.capacity
+        evicted = self._slots[index]
+        self._slots[index] = None
+        self._size -= 1
+        self.evictions += 1
+        self._strings.release(evicted.content)
+        self._strings.release(evicted.type)
+        for listener in self._listeners:
+            listener.on_evict(evicted)
+
+    def _append(self, content, type, created):
+        if self._size == self.capacity:
+            self._evict_oldest()
+        # Keep time order even if the wall clock steps backwards
+        created = max(created, self._last_created)
+        self._last_created = created
+        record = ScanRecord(self._next_id, self._strings.add(content),
+                            self._strings.add(type), created)
+        self._slots[(self._next_id - 1) % self.capacity] = record
+        self._next_id += 1
+        self._size += 1
+        for listener in self._listeners:
+            listener.on_append(record)
+        if self.max_bytes is not None:
+            while self._size > 1 and self.bytes_used > self.max_bytes:
+                self._evict_oldest()
+        return record
+
+    def append(self, content, type, created):
+        with self._lock:
+            record = self._append(content, type, created)
+            self._writes += 1
+            self._publish()
+            return record
+
+    def extend(self, scans):
+        # One critical section, so a batch gets consecutive ids
+        with self._lock:
+            records = [self._append(*scan) for scan in scans]
+            if records:
+                self._writes += 1
+                self._publish()
+            return records
+
+    def increment(self, record, by=1):
+        with self._lock:
+            record.count += by
+            self._writes += 1
+
+    def contains(self, record):
+        slots, next_id, size = self._view
+        if record.id is None or not next_id - size <= record.id < next_id:
+            return False
+        # Identity, so a record from an older buffer that happens to share
+        # an id with one held here is not mistaken for it
+        return slots[(record.id - 1) % self.capacity] is record
+
+    def clear(self):
+        with self._lock:
+            # A fresh list, so readers holding the old snapshot are unaffected
+            self._slots = [None] * self.capacity
+            self._size = 0
+            self._strings = StringTable()
+            self._writes += 1
+            self.clears += 1
+            self._publish()
+            for listener in self._listeners:
+                listener.on_clear()
+
+    def compact(self, min_created=None, max_bytes=None):
+        with self._lock:
+            size = self._size
+            while self._size:
+                oldest = self._slot(self._next_id - self._size)
+                expired = min_created is not None and oldest.created < min_created
+                if not expired and (max_bytes is None or self.bytes_used <= max_bytes):
+                    break
+                self._evict_oldest()
+            if self._size != size:
+                self._writes += 1
+                self._publish()
+
+    def _snapshot(self, before=None, since=None, until=None):
+        """Return (slots, ids newest first) for one consistent view"""
+        slots, next_id, size = self._view
+        capacity = self.capacity
+        newest = next_id - 1
+        oldest = next_id - size
+        if before is not None:
+            newest = min(newest, before - 1)
+        if newest < oldest:
+            return slots, range(0)
+
+        def created(record_id):
+            record = slots[(record_id - 1) % capacity]
+            if record is None or record.id != record_id:
+                return float('-inf')  # overwritten since the snapshot, so older than anything live
+            return record.created
+
+        # Ids are in time order, so a time range is a contiguous id range
+        ids = range(oldest, newest + 1)
+        if since is not None:
+            oldest += bisect.bisect_left(ids, since, key=created)
+        if until is not None:
+            newest = ids.start + bisect.bisect_right(ids, until, key=created) - 1
+        return slots, range(newest, oldest - 1, -1)
+
+    def _records(self, slots, ids):
+        capacity = self.capacity
+        for record_id in ids:
+            record = slots[(record_id - 1) % capacity]
+            if record is None or record.id != record_id:
+                return  # overwritten since the snapshot; everything older is gone too
+            yield record
+
+    def __iter__(self):
+        return self._records(*self._snapshot())
+
+    def __len__(self):
+        return self._view[2]
+
+    @property
+    def version(self):
+        return f'{self._token}-{self._writes}'
+
+    @property
+    def store_id(self):
+        # Each worker numbers its own scans, including forked copies of one buffer
+        return f'memory:{socket.gethostname()}:{os.getpid()}:{self._token}'
+
+    def iter_range(self, since=None, until=None, before=None):
+        return self._records(*self._snapshot(before, since, until))
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        slots, ids = self._snapshot(before, since, until)
+        return list(self._records(slots, ids[:limit]))
+
+
+def open_history_store(backend='memory', capacity=100, path=None, max_bytes=None):
+    """Create the history backend selected by name
+
+    `memory` keeps history in this process only. `shared` maps a file so
+    every gunicorn worker on the host sees the same history. `sqlite`
+    persists history to disk so it survives restarts. `max_bytes` is
+    enforced on every write by the memory backend; the others leave it
+    to compaction.
+    """
+    if backend == 'memory':
+        return RingBufferHistory(capacity, max_bytes)
+    if backend == 'shared':
+        from shared_history import SharedHistory
+        if path is None:
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(shm_dir, 'qr_scanner_history')
+        return SharedHistory(path, capacity)
+    if backend == 'sqlite':
+        from sqlite_history import SQLiteHistory
+        return SQLiteHistory(path or 'scan_history.db', capacity)
+    raise ValueError(f'Unknown history backend: {backend}')
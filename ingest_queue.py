@@ -0,0 +1,157 @@
+# ingest_queue.py - Write-behind queue between save_scan and the history
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from itertools import groupby
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """The queue is at capacity; the caller should retry later"""
+
+
+class IngestQueue:
+    """Bounded queue of accepted scans applied to the store in batches
+
+    `submit` only enqueues, so the request thread never waits on the
+    store. A consumer thread takes up to `batch_size` queued scans at a
+    time and passes each consecutive run from one client to
+    `apply(scans, client)`, with (content, accepted time) pairs, which
+    returns whether each scan was saved (False for a counted repeat). Outcomes of the last
+    `max_results` scans can be looked up by the id `submit` returned.
+
+    The consumer is started per process on first use, since threads do
+    not survive a gunicorn fork, and `close` drains what is left.
+    """
+
+    def __init__(self, apply, max_size=10000, batch_size=100, max_results=None):
+        self.apply = apply
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_results = max_results or max_size
+        self.accepted = 0
+        self.rejected = 0
+        self.applied = 0
+        self.failed = 0
+        self._seconds_per_scan = 0.0  # smoothed apply time, for Retry-After
+        self._queue = queue.Queue(max_size)
+        self._results = OrderedDict()  # scan id -> outcome, oldest first
+        self._closed = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='ingest-queue', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, content, client):
+        """Queue one scan and return its id, or raise QueueFull"""
+        if self._closed:
+            raise QueueFull('Ingest queue is shutting down')
+        scan_id = uuid.uuid4().hex
+        # Recorded first, so the consumer's outcome cannot be overwritten
+        self._remember(scan_id, {'status': 'queued'})
+        try:
+            self._queue.put_nowait((scan_id, content, client, time.time()))
+        except queue.Full:
+            with self._lock:
+                self._results.pop(scan_id, None)
+            self.rejected += 1
+            raise QueueFull(f'Ingest queue is full ({self.max_size} scans)')
+        self.accepted += 1
+        return scan_id
+
+    def _remember(self, scan_id, outcome):
+        with self._lock:
+            self._results[scan_id] = outcome
+            self._results.move_to_end(scan_id)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def result(self, scan_id):
+        """What became of a queued scan, or None once it has been forgotten"""
+        return self._results.get(scan_id)
+
+    def _take_batch(self, block=True):
+        try:
+            batch = [self._queue.get(block)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _apply(self, batch):
+        started = time.perf_counter()
+        for client, run in groupby(batch, key=lambda item: item[2]):
+            run = list(run)
+            try:
+                saved = self.apply([(item[1], item[3]) for item in run], client)
+            except Exception as e:
+                logger.exception('Applying %d queued scans failed', len(run))
+                self.failed += len(run)
+                for scan_id, *_ in run:
+                    self._remember(scan_id, {'status': 'failed', 'error': str(e)})
+                continue
+            self.applied += len(run)
+            for (scan_id, *_), new in zip(run, saved):
+                self._remember(scan_id, {'status': 'saved', 'duplicate': not new})
+        elapsed = (time.perf_counter() - started) / len(batch)
+        self._seconds_per_scan += 0.2 * (elapsed - self._seconds_per_scan)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def retry_after(self):
+        """Whole seconds for the consumer to clear a batch, for Retry-After"""
+        return max(1, math.ceil(self.batch_size * self._seconds_per_scan))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been applied"""
+        if self._pid != os.getpid():
+            # No consumer in this process; apply on the caller's thread
+            while True:
+                batch = self._take_batch(block=False)
+                if not batch:
+                    return True
+                self._apply(batch)
+                for _ in batch:
+                    self._queue.task_done()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Stop accepting scans and apply the ones already queued"""
+        self._closed = True
+        if not self.flush(timeout):
+            logger.warning('Ingest queue closed with %d scans unapplied', self.pending)
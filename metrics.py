@@ -0,0 +1,107 @@
+# metrics.py - Request instrumentation in the Prometheus text exposition format
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and two adds"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class RouteStats:
+    __slots__ = ('statuses', 'errors', 'latency', 'size')
+
+    def __init__(self):
+        self.statuses = {}  # status code -> requests
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+
+
+class RequestMetrics:
+    """Per-endpoint request counts, errors, latency and response sizes
+
+    Keyed by Flask endpoint name rather than URL, and by a method the
+    route accepts (callers pass `other` for the rest), so the number of
+    series stays fixed no matter what clients request. Values are per
+    process.
+    """
+
+    def __init__(self):
+        self._routes = {}  # (endpoint, method) -> RouteStats
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, seconds, size=None):
+        with self._lock:
+            stats = self._routes.get((endpoint, method))
+            if stats is None:
+                stats = self._routes[(endpoint, method)] = RouteStats()
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if status >= 500:
+                stats.errors += 1
+            stats.latency.observe(seconds)
+            if size is not None:
+                stats.size.observe(size)
+
+    def render(self, gauges=()):
+        """Return the exposition text; `gauges` adds (name, type, help, value) samples"""
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines += _header('http_requests_total', 'counter', 'Requests handled')
+            for (endpoint, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{{_labels(endpoint, method)},'
+                                 f'status="{status}"}} {count}')
+            lines += _header('http_request_errors_total', 'counter', 'Requests answered with a 5xx status')
+            for (endpoint, method), stats in routes:
+                lines.append(f'http_request_errors_total{{{_labels(endpoint, method)}}} {stats.errors}')
+            lines += _header('http_request_duration_seconds', 'histogram',
+                             'Time to produce the response, excluding streamed bodies')
+            for (endpoint, method), stats in routes:
+                lines += stats.latency.lines('http_request_duration_seconds', _labels(endpoint, method))
+            lines += _header('http_response_size_bytes', 'histogram',
+                             'Response body size, when known up front')
+            for (endpoint, method), stats in routes:
+                lines += stats.size.lines('http_response_size_bytes', _labels(endpoint, method))
+        for name, kind, description, value in gauges:
+            if value is None:
+                continue
+            lines += _header(name, kind, description)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _header(name, kind, description):
+    return [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(endpoint, method):
+    return f'endpoint="{_escape(endpoint)}",method="{_escape(method)}"'
@@ -0,0 +1,246 @@
+# partitioned_history.py - Per-client scan histories under one memory budget
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from history_store import HistoryStore, RingBufferHistory
+
+# Rough CPython cost of a partition beyond its ring buffer's own footprint
+# (the buffer and table objects and the bookkeeping entries here)
+PARTITION_OVERHEAD = 1024
+
+
+class PartitionedHistory:
+    """A bounded ring buffer per client, evicted least recently used first
+
+    Every client key gets its own RingBufferHistory of
+    `partition_capacity` records, so one busy device cannot push other
+    devices' scans out. Memory is bounded across all partitions by
+    `max_bytes` (each buffer's footprint plus a per-partition overhead)
+    and by `max_partitions`; when either is exceeded, whole
+    partitions are dropped starting with the one used longest ago.
+    Partitions idle for `idle_seconds` are dropped on the next write.
+
+    Writes go through this object, which holds one lock while a partition
+    changes and its cost is re-counted. Reads go to the partition, which
+    serves them without locking.
+
+    A new partition numbers its records from one past the highest id any
+    partition has issued, so a client whose history was cleared or
+    evicted never sees an id again.
+    """
+
+    def __init__(self, partition_capacity=100, max_bytes=None, max_partitions=10000,
+                 idle_seconds=None):
+        self.partition_capacity = partition_capacity
+        self.max_bytes = max_bytes
+        self.max_partitions = max_partitions
+        self.idle_seconds = idle_seconds
+        self.bytes_used = 0
+        self.partition_evictions = 0
+        self.clears = 0
+        self._partitions = OrderedDict()  # key -> [history, cost, last_used], LRU first
+        self._evictions = 0  # records in partitions that were dropped
+        self._entries = 0
+        self._next_id = 1  # above every id issued so far
+        self._token = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def _cost(self, history):
+        return PARTITION_OVERHEAD + history.bytes_used
+
+    def get(self, key):
+        """The partition for `key`, or None if it has none"""
+        entry = self._partitions.get(key)
+        return entry[0] if entry is not None else None
+
+    def for_client(self, key):
+        return ClientHistory(self, key)
+
+    def _write(self, key, change):
+        """Apply `change(history)` to the partition for `key`, then enforce the limits"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._partitions.get(key)
+            if entry is None:
+                history = RingBufferHistory(self.partition_capacity, first_id=self._next_id)
+                entry = self._partitions[key] = [history, self._cost(history), now]
+                self.bytes_used += entry[1]
+            else:
+                self._partitions.move_to_end(key)
+                entry[2] = now
+            history = entry[0]
+            size = len(history)
+            evictions = history.evictions
+            result = change(history)
+            self._next_id = max(self._next_id, history.next_id)
+            self._entries += len(history) - size
+            self._evictions += history.evictions - evictions
+            self._recount(entry)
+            self._enforce(key, now)
+            return result
+
+    def _recount(self, entry):
+        cost = self._cost(entry[0])
+        self.bytes_used += cost - entry[1]
+        entry[1] = cost
+
+    def _enforce(self, current, now):
+        partitions = self._partitions
+        while partitions:
+            key, (history, cost, last_used) = next(iter(partitions.items()))
+            if key == current:
+                break
+            over = ((self.max_bytes is not None and self.bytes_used > self.max_bytes)
+                    or len(partitions) > self.max_partitions
+                    or (self.idle_seconds is not None and now - last_used > self.idle_seconds))
+            if not over:
+                break
+            self._drop(key)
+        if self.max_bytes is not None and self.bytes_used > self.max_bytes:
+            # The writer's own partition is all that is left over the budget
+            entry = partitions[current]
+            size = len(entry[0])
+            evictions = entry[0].evictions
+            entry[0].compact(max_bytes=max(0, self.max_bytes - PARTITION_OVERHEAD))
+            self._entries += len(entry[0]) - size
+            self._evictions += entry[0].evictions - evictions
+            self._recount(entry)
+
+    def _drop(self, key, evicted=True):
+        history, cost, _ = self._partitions.pop(key)
+        self.bytes_used -= cost
+        self._entries -= len(history)
+        if evicted:
+            self._evictions += len(history)
+            self.partition_evictions += 1
+
+    def append(self, key, content, type, created):
+        return self._write(key, lambda history: history.append(content, type, created))
+
+    def extend(self, key, scans):
+        return self._write(key, lambda history: history.extend(scans))
+
+    def increment(self, key, record, by=1):
+        history = self.get(key)
+        if history is not None:
+            history.increment(record, by)
+        else:
+            record.count += by
+
+    def clear_partition(self, key):
+        with self._lock:
+            if key in self._partitions:
+                self._drop(key, evicted=False)
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self.bytes_used = 0
+            self._entries = 0
+            self.clears += 1
+
+    def compact(self, min_created=None, max_bytes=None):
+        """Apply age retention to every partition and drop idle or empty ones"""
+        now = time.monotonic()
+        with self._lock:
+            for key, entry in list(self._partitions.items()):
+                history = entry[0]
+                if self.idle_seconds is not None and now - entry[2] > self.idle_seconds:
+                    self._drop(key)
+                    continue
+                size = len(history)
+                evictions = history.evictions
+                history.compact(min_created)
+                self._entries += len(history) - size
+                self._evictions += history.evictions - evictions
+                self._recount(entry)
+                if not len(history):
+                    self._drop(key, evicted=False)
+        if max_bytes is not None and self.bytes_used > max_bytes:
+            with self._lock:
+                while self._partitions and self.bytes_used > max_bytes:
+                    self._drop(next(iter(self._partitions)))
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    @property
+    def store_id(self):
+        # Ids are only unique per partition, so each client view adds its key
+        return f'memory:{socket.gethostname()}:{os.getpid()}:{self._token}'
+
+    @property
+    def partitions(self):
+        return len(self._partitions)
+
+    @property
+    def interned(self):
+        return sum(entry[0].interned for entry in list(self._partitions.values()))
+
+    def __len__(self):
+        return self._entries
+
+
+class ClientHistory(HistoryStore):
+    """One client's view of a PartitionedHistory, usable wherever a store is"""
+
+    EMPTY = RingBufferHistory(1)
+
+    def __init__(self, parent, key):
+        self.parent = parent
+        self.key = key
+
+    def _history(self):
+        history = self.parent.get(self.key)
+        return history if history is not None else self.EMPTY
+
+    def append(self, content, type, created):
+        return self.parent.append(self.key, content, type, created)
+
+    def extend(self, scans):
+        return self.parent.extend(self.key, list(scans))
+
+    def increment(self, record, by=1):
+        self.parent.increment(self.key, record, by)
+
+    def contains(self, record):
+        return self._history().contains(record)
+
+    def clear(self):
+        self.parent.clear_partition(self.key)
+
+    def compact(self, min_created=None, max_bytes=None):
+        self.parent.compact(min_created, max_bytes)
+
+    def __iter__(self):
+        return iter(self._history())
+
+    def __len__(self):
+        return len(self._history())
+
+    @property
+    def version(self):
+        return self._history().version
+
+    @property
+    def bytes_used(self):
+        return self._history().bytes_used
+
+    @property
+    def evictions(self):
+        return self._history().evictions
+
+    @property
+    def store_id(self):
+        return f'{self.parent.store_id}:{self.key}'
+
+    def iter_range(self, since=None, until=None, before=None):
+        return self._history().iter_range(since, until, before)
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        return self._history().page(before, limit, since, until)
@@ -0,0 +1,97 @@
+# profiling.py - Opt-in cProfile sampling of production requests
+import cProfile
+import itertools
+import os
+import pstats
+import re
+import tempfile
+import threading
+
+SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}
+
+
+class RequestProfiler:
+    """Profiles one request in `every`, plus requests that ask for it
+
+    Stats are aggregated per endpoint and, when `directory` is set,
+    written there as `<endpoint>.<pid>.prof` after each sample (load them
+    with pstats or snakeviz). Only one request is profiled at a time, so
+    concurrent requests never compete for the interpreter's profiler
+    hook; a request due for sampling while another is being profiled is
+    simply skipped. Requests that are not sampled cost one counter
+    increment and a header lookup.
+    """
+
+    def __init__(self, every=0, directory=None):
+        self.every = every
+        self.directory = directory
+        self._counter = itertools.count(1)
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {}    # endpoint -> pstats.Stats
+        self._samples = {}  # endpoint -> profiled requests
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def due(self):
+        """Whether the next request falls on the sampling interval"""
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+    def start(self):
+        """Begin profiling the current request; None if another one is profiled"""
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, endpoint):
+        profile.disable()
+        self._active.release()
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._samples[endpoint] = self._samples.get(endpoint, 0) + 1
+            if self.directory:
+                self._dump(endpoint, stats)
+
+    def _dump(self, endpoint, stats):
+        name = re.sub(r'[^\w.-]', '_', endpoint)
+        path = os.path.join(self.directory, f'{name}.{os.getpid()}.prof')
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        stats.dump_stats(temp_path)
+        os.replace(temp_path, path)
+
+    def summary(self, endpoint=None, limit=20, sort='cumulative'):
+        """Hottest functions per endpoint, most expensive first"""
+        column = SORT_KEYS[sort]
+        result = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                if endpoint is not None and name != endpoint:
+                    continue
+                ranked = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)
+                result[name] = {
+                    'samples': self._samples[name],
+                    'total_time': round(stats.total_tt, 6),
+                    'functions': [
+                        {
+                            'function': pstats.func_std_string(func),
+                            'calls': calls,
+                            'primitive_calls': primitive,
+                            'total_time': round(tottime, 6),
+                            'cumulative_time': round(cumtime, 6)
+                        }
+                        for func, (primitive, calls, tottime, cumtime, _) in ranked[:limit]
+                    ]
+                }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._samples.clear()
@@ -0,0 +1,175 @@
+# qr_decode.py - Server-side QR decoding of uploaded images in worker processes
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+# Larger photos are scaled down before decoding; phone cameras produce
+# far more pixels than a QR code needs
+MAX_DECODE_DIMENSION = 2048
+MAX_IMAGE_PIXELS = 50_000_000  # refuse decompression bombs outright
+
+
+class DecodeError(Exception):
+    """The image could not be decoded"""
+
+
+class DecoderBusy(Exception):
+    """Too many images are already waiting for a worker"""
+
+
+class DecoderUnavailable(Exception):
+    """The decoding libraries are not installed"""
+
+
+def available():
+    try:
+        import PIL  # noqa: F401
+        import zxingcpp  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def decode_image(data):
+    """Return the QR codes found in an encoded image, as dicts
+
+    Runs inside a worker process.
+    """
+    import zxingcpp
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Lets JPEG decode straight to a reduced, greyscale image
+            image.draft('L', (MAX_DECODE_DIMENSION, MAX_DECODE_DIMENSION))
+            image = image.convert('L')
+    except Image.DecompressionBombError:
+        raise DecodeError('Image has too many pixels') from None
+    except (OSError, ValueError):
+        raise DecodeError('Not a readable image') from None
+    if max(image.size) > MAX_DECODE_DIMENSION:
+        image.thumbnail((MAX_DECODE_DIMENSION, MAX_DECODE_DIMENSION))
+    formats = zxingcpp.BarcodeFormat.QRCode | zxingcpp.BarcodeFormat.MicroQRCode
+    return [
+        {'content': barcode.text, 'format': barcode.format.name}
+        for barcode in zxingcpp.read_barcodes(image, formats=formats)
+        if barcode.valid
+    ]
+
+
+def _default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class DecodePool:
+    """Process pool for CPU-bound decoding with a bounded backlog
+
+    At most `max_pending` images may be queued or running at once;
+    `submit` raises DecoderBusy beyond that instead of letting the
+    backlog grow. Each job has `timeout` seconds from submission. One
+    still queued at its deadline is cancelled; one still running has the
+    workers terminated and the pool rebuilt, since a process cannot be
+    interrupted mid-decode, so other jobs running at that moment fail too.
+    The pool is created per process on first use so gunicorn workers
+    each get their own.
+    """
+
+    def __init__(self, workers=None, max_pending=64, timeout=10):
+        self.workers = workers or _default_workers()
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.restarts = 0
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            # forkserver avoids forking this process with its threads and locks
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context(method)
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, data):
+        """Queue one encoded image; returns a future for `result`"""
+        if not available():
+            raise DecoderUnavailable('Install Pillow and zxing-cpp to decode images')
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise DecoderBusy(f'{self._pending} images already queued')
+            executor = self._get_executor()
+            future = executor.submit(decode_image, data)
+            self._pending += 1
+        future.executor = executor
+        future.deadline = time.monotonic() + self.timeout
+        future.add_done_callback(self._job_done)
+        return future
+
+    def result(self, future):
+        """Wait for a submitted job until its deadline and return its codes"""
+        try:
+            return future.result(max(0, future.deadline - time.monotonic()))
+        except FutureTimeout:
+            if not future.cancel():
+                self._restart(future.executor)
+            raise DecodeError('Decoding timed out') from None
+        except BrokenProcessPool:
+            self._restart(future.executor)
+            raise DecodeError('Decoder worker stopped') from None
+
+    def _restart(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return  # already replaced after another job's failure
+            self._executor = None
+        self.restarts += 1
+        # Killing the workers fails the futures of everything still running
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def decode(self, images):
+        """Decode several images in parallel; returns a result or exception per image"""
+        futures = []
+        for data in images:
+            try:
+                futures.append(self.submit(data))
+            except DecoderBusy as e:
+                futures.append(e)
+        results = []
+        for future in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+                continue
+            try:
+                results.append(self.result(future))
+            except DecodeError as e:
+                results.append(e)
+        return results
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
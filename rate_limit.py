@@ -0,0 +1,242 @@
+# rate_limit.py - Per-client token buckets, optionally shared by all workers
+import hashlib
+import ipaddress
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from shared_history import _FileLock
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_limit(text):
+    """Parse `N/s`, `N/m` or `N/h` into (tokens per second, burst)
+
+    The bucket holds N tokens, so a client may send N requests at once
+    and then N per period.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*/\s*([smh])\s*', text)
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f'Invalid rate limit {text!r}; expected N/s, N/m or N/h')
+    burst = float(match.group(1))
+    return burst / PERIODS[match.group(2)], burst
+
+
+def address_key(address):
+    """Rate limit key for a peer address
+
+    IPv6 clients usually hold a whole /64, so they are limited per /64
+    rather than per address they could rotate through.
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return f'ip:{address}'
+    if ip.version == 6:
+        if ip.ipv4_mapped is not None:
+            return f'ip:{ip.ipv4_mapped}'
+        return f'ip:{ipaddress.ip_network((ip, 64), strict=False)}'
+    return f'ip:{ip}'
+
+
+def take_token(tokens, updated, now, rate, burst):
+    """Refill a bucket to `now` and spend one token
+
+    Returns (tokens left, seconds until a token is available), with a
+    wait of 0 when the token was granted. A bucket seen for the first
+    time should be passed tokens=burst.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Buckets for this process only, forgetting the least recently used beyond `max_keys`"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens, wait = take_token(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Header: magic, slot count. Slot: key hash (0 when free), tokens, last
+# update and when the bucket will be full again, all in epoch seconds
+HEADER = struct.Struct('<4sI')
+HEADER_SIZE = 64
+MAGIC = b'QRL1'
+SLOT = struct.Struct('<Qddd')
+PROBES = 8
+
+
+class SharedBuckets:
+    """Buckets in a memory-mapped hash table shared by every worker
+
+    Each key hashes to a run of PROBES slots. A new key takes a free
+    slot in its run, or one whose bucket has refilled completely, which
+    is the same as having none. Only when every slot in the run is
+    still refilling is the one closest to full taken over, and the new
+    key inherits its tokens rather than a full bucket, so crowding the
+    table can throttle clients early but never resets anyone's limit.
+    Size `slots` well above the number of clients active per refill
+    period to keep that rare.
+    """
+
+    def __init__(self, path, slots=65536):
+        if slots < PROBES:
+            raise ValueError(f'slots must be at least {PROBES}')
+        self.path = path
+        self.slots = slots
+        self._file_size = HEADER_SIZE + slots * SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = _FileLock(path)
+        with self._locked():
+            header = os.pread(self._fd, HEADER.size, 0)
+            if (len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, slots)
+                    or os.fstat(self._fd).st_size != self._file_size):
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._file_size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, slots), 0)
+        self._map = mmap.mmap(self._fd, self._file_size, mmap.MAP_SHARED)
+
+    def _locked(self):
+        return self._lock
+
+    def _offset(self, index):
+        return HEADER_SIZE + (index % self.slots) * SLOT.size
+
+    def take(self, key, rate, burst, now):
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(),
+                                'little') or 1
+        with self._locked():
+            victim = None
+            victim_full_at = None
+            for probe in range(PROBES):
+                offset = self._offset(digest + probe)
+                stored, tokens, updated, full_at = SLOT.unpack_from(self._map, offset)
+                if stored == digest:
+                    break
+                if stored == 0 or full_at <= now:
+                    if victim_full_at != 0:
+                        victim, victim_full_at = offset, 0
+                elif victim is None or full_at < victim_full_at:
+                    victim, victim_full_at = offset, full_at
+            else:
+                offset = victim
+                if victim_full_at:
+                    # Still refilling: carry on from its state, not a full bucket
+                    _, tokens, updated, _ = SLOT.unpack_from(self._map, offset)
+                else:
+                    tokens, updated = burst, now
+            tokens, wait = take_token(tokens, updated, now, rate, burst)
+            SLOT.pack_into(self._map, offset, digest, tokens, now,
+                           now + (burst - tokens) / rate)
+            return wait
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+        self._lock.close()
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite table, shared by workers and kept across restarts"""
+
+    CLEANUP_EVERY = 1000  # takes between deletions of refilled buckets
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_buckets ('
+                     'key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                     'updated REAL NOT NULL, full_at REAL NOT NULL)')
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?',
+                               (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, wait = take_token(tokens, updated, now, rate, burst)
+            conn.execute('INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, now + (burst - tokens) / rate))
+            self._takes += 1
+            if self._takes % self.CLEANUP_EVERY == 0:
+                conn.execute('DELETE FROM rate_buckets WHERE full_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def open_buckets(backend='memory', path=None):
+    """Create the bucket storage selected by name, like open_history_store"""
+    if backend == 'memory':
+        return MemoryBuckets()
+    if backend == 'shared':
+        if path is None:
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(shm_dir, 'qr_scanner_rate_limits')
+        return SharedBuckets(path)
+    if backend == 'sqlite':
+        return SQLiteBuckets(path or 'rate_limits.db')
+    raise ValueError(f'Unknown rate limit backend: {backend}')
+
+
+class RateLimiter:
+    """Token-bucket limits per client, with a separate budget per kind of request
+
+    `limits` maps a budget name to (tokens per second, burst). `check`
+    spends one token from the client's bucket for that budget and
+    returns 0 when the request may proceed, otherwise the seconds until
+    it could. Budgets without a limit are never throttled.
+    """
+
+    def __init__(self, limits, buckets):
+        self.limits = limits
+        self.buckets = buckets
+        self.limited = 0
+
+    def check(self, budget, client, now=None):
+        limit = self.limits.get(budget)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.time() if now is None else now
+        wait = self.buckets.take(f'{budget}:{client}', rate, burst, now)
+        if wait:
+            self.limited += 1
+        return wait
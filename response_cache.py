@@ -0,0 +1,125 @@
+# response_cache.py - Pre-serialized responses for read-heavy endpoints
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+
+class CachedPayload:
+    """Encoded response body with a lazily built gzip variant"""
+
+    __slots__ = ('body', 'mimetype', '_gzipped')
+
+    def __init__(self, body, mimetype='application/json'):
+        self.body = body
+        self.mimetype = mimetype
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+    def to_response(self, accept_gzip=False, min_gzip_size=1024):
+        if accept_gzip and len(self.body) >= min_gzip_size:
+            response = Response(self.gzipped(), mimetype=self.mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(self.body, mimetype=self.mimetype)
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class ResponseCache:
+    """LRU cache of encoded views, each tied to the history version
+
+    An entry built for an older version is rebuilt on the next request,
+    so every write to the history invalidates the cached views without
+    having to find them. Besides `max_entries`, the cache holds at most
+    `max_bytes`, counting each body twice to cover its gzip variant; a
+    payload too large to fit is served without being cached.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, payload, cost)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """Return the payload for `key` at `version`, building it if needed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        payload = build()
+        cost = 2 * len(payload.body)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[2]
+            if self.max_bytes is not None and cost > self.max_bytes:
+                return payload
+            self._entries[key] = (version, payload, cost)
+            self.bytes_used += cost
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.bytes_used > self.max_bytes):
+                self.bytes_used -= self._entries.popitem(last=False)[1][2]
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+
+class StaticPage:
+    """A file served from memory with a content-hash ETag and precompressed gzip
+
+    The file is read, hashed and compressed once. Each request only stats
+    it, so an edited file is picked up without a restart.
+    """
+
+    def __init__(self, path, mimetype='text/html; charset=utf-8'):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = None
+        self._stamp = None
+        self._payload = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            with open(self.path, 'rb') as f:
+                body = f.read()
+            payload = CachedPayload(body, self.mimetype)
+            payload.gzipped()
+            self.etag = hashlib.sha256(body).hexdigest()[:32]
+            self._payload = payload
+            self._stamp = stamp
+
+    def to_response(self, if_none_match, accept_gzip=False):
+        self.load()
+        if self.etag in if_none_match:
+            response = Response(status=304)
+        else:
+            response = self._payload.to_response(accept_gzip)
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -0,0 +1,50 @@
+# retention.py - Background enforcement of history retention limits
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Compactor:
+    """Periodically drops scans past the age or size limits
+
+    `ttl` is the maximum age in seconds and `max_bytes` the budget for
+    the store's `bytes_used`; either may be None. The thread is started per
+    process on first use, since threads do not survive a gunicorn fork.
+    """
+
+    def __init__(self, store, ttl=None, max_bytes=None, interval=60):
+        self.store = store
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl is not None or self.max_bytes is not None
+
+    def run_once(self, now=None):
+        now = time.time() if now is None else now
+        min_created = now - self.ttl if self.ttl is not None else None
+        self.store.compact(min_created, self.max_bytes)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('History compaction failed')
+
+    def ensure_started(self):
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='history-compactor', daemon=True).start()
+            self._pid = os.getpid()
@@ -0,0 +1,144 @@
+# scan_stats.py - Incrementally maintained scan statistics
+import threading
+import time
+
+
+class SpaceSaving:
+    """Approximate top-k counter (Metwally et al. Space-Saving)
+
+    Tracks at most `capacity` items. When a new item arrives and the
+    table is full, it replaces the item with the smallest count and
+    inherits that count as its error bound, so every count reported is an
+    overestimate by at most `error`.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._counts = {}  # item -> [count, error]
+
+    def offer(self, item, n=1):
+        counter = self._counts.get(item)
+        if counter is not None:
+            counter[0] += n
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = [n, 0]
+        else:
+            victim = min(self._counts, key=lambda key: self._counts[key][0])
+            floor = self._counts.pop(victim)[0]
+            self._counts[item] = [floor + n, floor]
+
+    def top(self, n):
+        ranked = sorted(self._counts.items(), key=lambda entry: entry[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:n]]
+
+    def clear(self):
+        self._counts.clear()
+
+
+class SlidingCounter:
+    """Event count over the last `seconds`, kept in one-second buckets
+
+    A running total is adjusted as buckets expire, so reading the count
+    never has to sum the window.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._buckets = [0] * seconds
+        self._total = 0
+        self._now = None  # second the newest bucket belongs to
+
+    def _advance(self, second):
+        if self._now is None:
+            self._now = second
+            return
+        elapsed = second - self._now
+        if elapsed <= 0:
+            return
+        if elapsed >= self.seconds:
+            self._buckets = [0] * self.seconds
+            self._total = 0
+        else:
+            for s in range(self._now + 1, second + 1):
+                index = s % self.seconds
+                self._total -= self._buckets[index]
+                self._buckets[index] = 0
+        self._now = second
+
+    def add(self, now, n=1):
+        second = int(now)
+        self._advance(second)
+        self._buckets[second % self.seconds] += n
+        self._total += n
+
+    def count(self, now):
+        self._advance(int(now))
+        return self._total
+
+    def clear(self):
+        self._buckets = [0] * self.seconds
+        self._total = 0
+        self._now = None
+
+
+class ScanStats:
+    """Aggregates over every scan this process received since the last clear
+
+    `sync` takes the history's clear count, so a clear made by another
+    worker sharing the history resets these aggregates too.
+    """
+
+    WINDOWS = {'1m': 60, '5m': 300, '15m': 900}
+
+    def __init__(self, tracked_contents=100):
+        self.total = 0
+        self.by_type = {}
+        self.top_contents = SpaceSaving(tracked_contents)
+        self.rates = {name: SlidingCounter(seconds) for name, seconds in self.WINDOWS.items()}
+        self._clears = None  # history clear count last synced to
+        self._lock = threading.Lock()
+
+    def record(self, scan_type, content, n=1, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.total += n
+            self.by_type[scan_type] = self.by_type.get(scan_type, 0) + n
+            self.top_contents.offer(content, n)
+            for counter in self.rates.values():
+                counter.add(now, n)
+
+    def sync(self, clears):
+        """Start over if the history has been cleared since the last sync"""
+        if clears == self._clears:
+            return
+        with self._lock:
+            if self._clears is not None and clears != self._clears:
+                self._reset()
+            self._clears = clears
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.by_type = {}
+        self.top_contents.clear()
+        for counter in self.rates.values():
+            counter.clear()
+
+    def snapshot(self, top_n=10, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return {
+                'total_scans': self.total,
+                'by_type': dict(self.by_type),
+                'top_contents': [
+                    {'content': content, 'count': count, 'max_error': error}
+                    for content, count, error in self.top_contents.top(top_n)
+                ],
+                'scans_per_minute': {
+                    name: round(counter.count(now) * 60 / counter.seconds, 2)
+                    for name, counter in self.rates.items()
+                }
+            }
@@ -0,0 +1,237 @@
+# search_index.py - Indexed search over scan history
+import bisect
+import re
+import threading
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_AFFIX_LENGTH = 2  # shorter partial tokens match too much to be useful
+MERGE_THRESHOLD = 1024
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def query_tokens(text, anchored):
+    """Split a search string into tokens the index can look up
+
+    Returns (exact, prefix, suffix): words that must appear as whole
+    tokens in a matching scan, a trailing word that must start a token and
+    a leading word that must end one. The leading word is exact when the
+    query is `anchored` to the start of content. A lone word in an
+    unanchored query can sit anywhere inside a token, so it yields nothing.
+    """
+    text = text.lower()
+    exact = []
+    prefix = suffix = None
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        at_start = match.start() == 0 and not anchored
+        at_end = match.end() == len(text)
+        if at_start and at_end:
+            continue
+        if at_start:
+            suffix = token
+        elif at_end:
+            prefix = token
+        else:
+            exact.append(token)
+    return exact, prefix, suffix
+
+
+def matches(record, substring=None, prefix=None, types=None):
+    """Check a single record against the search filters"""
+    if types and record.type not in types:
+        return False
+    content = record.content.lower()
+    if prefix and not content.startswith(prefix.lower()):
+        return False
+    if substring and substring.lower() not in content:
+        return False
+    return True
+
+
+def scan_search(records, substring=None, prefix=None, types=None, limit=50):
+    """Search by walking the history, for backends without an index"""
+    results = []
+    for record in records:
+        if matches(record, substring, prefix, types):
+            results.append(record)
+            if len(results) >= limit:
+                break
+    return results
+
+
+class Vocabulary:
+    """Sorted token list for prefix lookups, with buffered updates
+
+    Inserting into one big sorted list shifts it on every new token, and
+    scans are full of unique tokens (serials, ids). Additions and removals
+    are buffered instead and merged in a single pass once the buffers
+    reach 1/16 of the list (at least MERGE_THRESHOLD), which keeps the
+    amortized cost per update constant. Lookups check the buffers
+    linearly.
+    """
+
+    def __init__(self):
+        self._sorted = []
+        self._added = set()
+        self._removed = set()
+
+    def add(self, token):
+        if token in self._removed:
+            self._removed.discard(token)  # still present in the sorted list
+        else:
+            self._added.add(token)
+            self._maybe_merge()
+
+    def discard(self, token):
+        if token in self._added:
+            self._added.discard(token)
+        else:
+            self._removed.add(token)
+            self._maybe_merge()
+
+    def _maybe_merge(self):
+        pending = len(self._added) + len(self._removed)
+        if pending > MERGE_THRESHOLD and pending > len(self._sorted) // 16:
+            removed = self._removed
+            kept = [token for token in self._sorted if token not in removed]
+            # Timsort merges the sorted run and the short tail in linear time
+            kept.extend(self._added)
+            kept.sort()
+            self._sorted = kept
+            self._added = set()
+            self._removed = set()
+
+    def starting_with(self, start):
+        tokens = self._sorted
+        index = bisect.bisect_left(tokens, start)
+        while index < len(tokens) and tokens[index].startswith(start):
+            if tokens[index] not in self._removed:
+                yield tokens[index]
+            index += 1
+        for token in self._added:
+            if token.startswith(start):
+                yield token
+
+    def clear(self):
+        self._sorted = []
+        self._added = set()
+        self._removed = set()
+
+
+class SearchIndex:
+    """Inverted token index and type index over the records in history
+
+    Subscribes to an in-process history store, so records are indexed
+    when they are appended and dropped again when the ring buffer evicts
+    them. Candidates from the index are verified against the record, so
+    results are exact; the index only decides which records to look at.
+    """
+
+    def __init__(self):
+        self._records = {}    # id -> record
+        self._postings = {}   # token -> set of ids
+        self._by_type = {}    # type -> set of ids
+        self._vocabulary = Vocabulary()  # tokens, for prefix lookups
+        self._reversed = Vocabulary()    # reversed tokens, for suffix lookups
+        self._lock = threading.Lock()
+
+    def on_append(self, record):
+        with self._lock:
+            self._records[record.id] = record
+            for token in set(tokenize(record.content)):
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = set()
+                    self._vocabulary.add(token)
+                    self._reversed.add(token[::-1])
+                posting.add(record.id)
+            self._by_type.setdefault(record.type, set()).add(record.id)
+
+    def on_evict(self, record):
+        with self._lock:
+            if self._records.pop(record.id, None) is None:
+                return
+            for token in set(tokenize(record.content)):
+                posting = self._postings.get(token)
+                if posting is None:
+                    continue
+                posting.discard(record.id)
+                if not posting:
+                    del self._postings[token]
+                    self._vocabulary.discard(token)
+                    self._reversed.discard(token[::-1])
+            ids = self._by_type.get(record.type)
+            if ids is not None:
+                ids.discard(record.id)
+                if not ids:
+                    del self._by_type[record.type]
+
+    def on_clear(self):
+        with self._lock:
+            self._records.clear()
+            self._postings.clear()
+            self._by_type.clear()
+            self._vocabulary.clear()
+            self._reversed.clear()
+
+    def _matching_ids(self, vocabulary, start, reverse=False):
+        postings = [self._postings[token[::-1] if reverse else token]
+                    for token in vocabulary.starting_with(start)]
+        if len(postings) == 1:
+            return postings[0]  # only read, so no copy is needed
+        return set().union(*postings)
+
+    def _candidates(self, substring, prefix, types):
+        sets = []
+        if types:
+            if len(types) == 1:
+                sets.append(self._by_type.get(next(iter(types)), set()))
+            else:
+                sets.append(set().union(*(self._by_type.get(t, ()) for t in types)))
+        for text, anchored in ((substring, False), (prefix, True)):
+            if not text:
+                continue
+            exact, token_prefix, token_suffix = query_tokens(text, anchored)
+            sets.extend(self._postings.get(token, set()) for token in exact)
+            if token_prefix and len(token_prefix) >= MIN_AFFIX_LENGTH:
+                sets.append(self._matching_ids(self._vocabulary, token_prefix))
+            if token_suffix and len(token_suffix) >= MIN_AFFIX_LENGTH:
+                sets.append(self._matching_ids(self._reversed, token_suffix[::-1], reverse=True))
+        if not sets:
+            return None  # nothing indexable; every record is a candidate
+        sets.sort(key=len)
+        # Intersect smallest first; the index's own sets are never modified
+        candidates = sets[0]
+        for other in sets[1:]:
+            if not candidates:
+                break
+            candidates = candidates & other
+        return candidates
+
+    def search(self, substring=None, prefix=None, types=None, limit=50):
+        """Return up to `limit` matching records, newest first"""
+        with self._lock:
+            candidates = self._candidates(substring, prefix, types)
+            if candidates is None:
+                # Ids are inserted in increasing order, so this is newest first
+                ids = reversed(self._records)
+            elif len(candidates) * 8 > len(self._records):
+                # Cheaper to walk everything than to sort a large candidate set
+                ids = (record_id for record_id in reversed(self._records)
+                       if record_id in candidates)
+            else:
+                ids = sorted(candidates, reverse=True)
+            results = []
+            for record_id in ids:
+                record = self._records[record_id]
+                if matches(record, substring, prefix, types):
+                    results.append(record)
+                    if len(results) >= limit:
+                        break
+            return results
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,291 @@
+# shared_history.py - Scan history shared between worker processes
+import bisect
+import fcntl
+import mmap
+import os
+import socket
+import struct
+import threading
+from itertools import islice
+
+from history_store import HistoryStore, ScanRecord
+
+# Header: magic, slot count, slot size, total writes, first visible write,
+# in-place updates, then the eviction and clear counts at EVICTIONS_OFFSET
+# and CLEARS_OFFSET
+HEADER = struct.Struct('<4sIIxxxxQQQ')
+HEADER_SIZE = 64
+MAGIC = b'QRH3'
+WRITTEN_OFFSET = 16
+START_OFFSET = 24
+UPDATES_OFFSET = 32
+EVICTIONS_OFFSET = 40
+CLEARS_OFFSET = 48
+
+# Slot: sequence number, scan count, created (epoch seconds),
+# content/type lengths, payload
+SLOT_HEADER = struct.Struct('<QIdIH')
+SEQ = struct.Struct('<Q')
+COUNT = struct.Struct('<I')
+COUNT_OFFSET = 8
+CREATED = struct.Struct('<d')
+CREATED_OFFSET = 12
+COUNTER = struct.Struct('<Q')
+
+DEFAULT_SLOT_SIZE = 4608  # fits the largest QR payload (4296 chars)
+
+
+class SharedHistory(HistoryStore):
+    """History kept in a memory-mapped file shared by every worker
+
+    The file holds a fixed number of fixed-size slots. Appends take an
+    exclusive flock, write the slot and then bump the head counter, so
+    all workers see one ordered history. Reads never lock: every slot
+    carries the sequence number of the write that filled it, and a read
+    that races with an overwrite is detected and skipped.
+    """
+
+    def __init__(self, path, capacity=100, slot_size=DEFAULT_SLOT_SIZE):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError('slot_size is too small')
+        self.path = path
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._file_size = HEADER_SIZE + capacity * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = _FileLock(path)
+        with self._locked():
+            if not self._header_matches():
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._file_size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, capacity, slot_size, 0, 0, 0), 0)
+        self._map = mmap.mmap(self._fd, self._file_size, mmap.MAP_SHARED)
+        self._view = memoryview(self._map)
+
+    def _header_matches(self):
+        header = os.pread(self._fd, HEADER.size, 0)
+        if len(header) < HEADER.size:
+            return False
+        magic, slots, slot_size, _, _, _ = HEADER.unpack(header)
+        return (magic == MAGIC and slots == self.capacity
+                and slot_size == self.slot_size
+                and os.fstat(self._fd).st_size == self._file_size)
+
+    def _locked(self):
+        return self._lock
+
+    def _counters(self):
+        written = COUNTER.unpack_from(self._map, WRITTEN_OFFSET)[0]
+        start = COUNTER.unpack_from(self._map, START_OFFSET)[0]
+        return written, max(start, written - self.capacity)
+
+    def _slot_offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * self.slot_size
+
+    def _encode(self, content, type):
+        encoded = [value.encode('utf-8') for value in (content, type)]
+        payload_size = sum(len(value) for value in encoded)
+        if SLOT_HEADER.size + payload_size > self.slot_size:
+            raise ValueError('Scan is too large for a shared history slot')
+        return encoded
+
+    def _created(self, seq):
+        return CREATED.unpack_from(self._map, self._slot_offset(seq) + CREATED_OFFSET)[0]
+
+    def _write_slot(self, seq, created, encoded):
+        offset = self._slot_offset(seq)
+        # Invalidate the slot first so readers never accept a torn write
+        SEQ.pack_into(self._map, offset, 0)
+        SLOT_HEADER.pack_into(self._map, offset, 0, 1, created, *map(len, encoded))
+        position = offset + SLOT_HEADER.size
+        for value in encoded:
+            self._map[position:position + len(value)] = value
+            position += len(value)
+        SEQ.pack_into(self._map, offset, seq + 1)
+
+    def append(self, content, type, created):
+        return self.extend([(content, type, created)])[0]
+
+    def extend(self, scans):
+        scans = list(scans)
+        encoded = [self._encode(content, type) for content, type, _ in scans]
+        records = []
+        with self._locked():
+            written, start = self._counters()
+            seq = written
+            # Keep time order even if the wall clock steps backwards
+            last_created = self._created(seq - 1) if seq > start else 0.0
+            for (content, type, created), fields in zip(scans, encoded):
+                created = max(created, last_created)
+                last_created = created
+                self._write_slot(seq, created, fields)
+                seq += 1
+                records.append(ScanRecord(seq, content, type, created))
+            COUNTER.pack_into(self._map, WRITTEN_OFFSET, seq)
+            self._count_evictions(written - start + len(scans) - self.capacity)
+        return records
+
+    def _count_evictions(self, evicted):
+        if evicted > 0:
+            total = COUNTER.unpack_from(self._map, EVICTIONS_OFFSET)[0]
+            COUNTER.pack_into(self._map, EVICTIONS_OFFSET, total + evicted)
+
+    def _read(self, seq):
+        offset = self._slot_offset(seq)
+        stamp, count, created, content_len, type_len = SLOT_HEADER.unpack_from(self._map, offset)
+        if stamp != seq + 1:
+            return None
+        position = offset + SLOT_HEADER.size
+        content = str(self._view[position:position + content_len], 'utf-8', 'replace')
+        position += content_len
+        type = str(self._view[position:position + type_len], 'utf-8', 'replace')
+        if SEQ.unpack_from(self._map, offset)[0] != seq + 1:
+            return None
+        return ScanRecord(seq + 1, content, type, created, count)
+
+    def increment(self, record, by=1):
+        with self._locked():
+            offset = self._slot_offset(record.id - 1)
+            # Skip records whose slot has since been reused
+            if SEQ.unpack_from(self._map, offset)[0] == record.id:
+                count = COUNT.unpack_from(self._map, offset + COUNT_OFFSET)[0] + by
+                COUNT.pack_into(self._map, offset + COUNT_OFFSET, count)
+                record.count = count
+                updates = COUNTER.unpack_from(self._map, UPDATES_OFFSET)[0]
+                COUNTER.pack_into(self._map, UPDATES_OFFSET, updates + 1)
+
+    def contains(self, record):
+        written, start = self._counters()
+        if record.id is None or not start < record.id <= written:
+            return False
+        return SEQ.unpack_from(self._map, self._slot_offset(record.id - 1))[0] == record.id
+
+    def clear(self):
+        with self._locked():
+            written = COUNTER.unpack_from(self._map, WRITTEN_OFFSET)[0]
+            COUNTER.pack_into(self._map, START_OFFSET, written)
+            clears = COUNTER.unpack_from(self._map, CLEARS_OFFSET)[0]
+            COUNTER.pack_into(self._map, CLEARS_OFFSET, clears + 1)
+
+    def compact(self, min_created=None, max_bytes=None):
+        # The file has a fixed size, so only age-based retention applies
+        if min_created is None:
+            return
+        with self._locked():
+            written, start = self._counters()
+            seqs = range(start, written)
+            first_kept = start + bisect.bisect_left(seqs, min_created, key=self._created)
+            if first_kept != start:
+                COUNTER.pack_into(self._map, START_OFFSET, first_kept)
+                self._count_evictions(first_kept - start)
+
+    def _seqs(self, before=None, since=None, until=None):
+        written, start = self._counters()
+        # Record ids are write sequence numbers plus one
+        newest = written if before is None else min(written, before - 1)
+        seqs = range(start, max(start, newest))
+        first = start
+        if since is not None:
+            first += bisect.bisect_left(seqs, since, key=self._created)
+        if until is not None:
+            newest = start + bisect.bisect_right(seqs, until, key=self._created)
+        return range(newest - 1, first - 1, -1)
+
+    def iter_range(self, since=None, until=None, before=None):
+        for seq in self._seqs(before, since, until):
+            record = self._read(seq)
+            if record is None:
+                # Overwritten by a newer append; everything older is gone too
+                return
+            yield record
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def __len__(self):
+        written, start = self._counters()
+        return written - start
+
+    @property
+    def bytes_used(self):
+        return self._file_size
+
+    @property
+    def evictions(self):
+        return COUNTER.unpack_from(self._map, EVICTIONS_OFFSET)[0]
+
+    @property
+    def clears(self):
+        return COUNTER.unpack_from(self._map, CLEARS_OFFSET)[0]
+
+    @property
+    def store_id(self):
+        return f'shared:{socket.gethostname()}:{os.path.abspath(self.path)}'
+
+    @property
+    def version(self):
+        updates = COUNTER.unpack_from(self._map, UPDATES_OFFSET)[0]
+        return '%d-%d-%d' % (self._counters() + (updates,))
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        return list(islice(self.iter_range(since, until, before), limit))
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        os.close(self._fd)
+        self._lock.close()
+
+
+# Serializes reopening a _FileLock after a fork, when its own locks cannot be trusted
+_reopen_lock = threading.Lock()
+
+
+class _FileLock:
+    """Exclusive flock on `path` held for the duration of a with block
+
+    flock only excludes other processes, so threads in this process are
+    serialized with a regular lock first. A flock belongs to the open file
+    description, which forked workers (gunicorn --preload) would share,
+    and a forked thread lock may be copied while held, so each process
+    opens the file and creates the thread lock afresh on first use. The
+    MAP_SHARED mappings made before the fork stay valid in the child.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _ensure_process(self):
+        if self._pid == os.getpid():
+            return
+        with _reopen_lock:
+            if self._pid != os.getpid():
+                inherited = self._fd
+                self._open()
+                os.close(inherited)
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self):
+        self._ensure_process()
+        self._thread_lock.acquire()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
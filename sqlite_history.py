@@ -0,0 +1,314 @@
+# sqlite_history.py - Durable scan history stored in SQLite
+import atexit
+import collections
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+
+from history_store import HistoryStore, ScanRecord
+
+logger = logging.getLogger(__name__)
+
+SCANS_TABLE = '''
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content TEXT NOT NULL,
+    type TEXT NOT NULL,
+    created REAL NOT NULL,
+    count INTEGER NOT NULL DEFAULT 1
+)
+'''
+
+SCHEMA = SCANS_TABLE + ''';
+CREATE INDEX IF NOT EXISTS scans_created ON scans (created);
+CREATE TABLE IF NOT EXISTS history_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO history_meta (name, value) VALUES ('updates', 0);
+INSERT OR IGNORE INTO history_meta (name, value) VALUES ('evictions', 0);
+INSERT OR IGNORE INTO history_meta (name, value) VALUES ('clears', 0);
+'''
+
+COLUMNS = 'id, content, type, created, count'
+# What HISTORY_MAX_BYTES and bytes_used count for a row: its UTF-8 payload
+ROW_BYTES = 'length(CAST(content AS BLOB)) + length(CAST(type AS BLOB))'
+
+
+class HistoryWriteError(Exception):
+    """A queued write was not committed"""
+
+WAIT_POLL_SECONDS = 1.0  # how often a waiting caller checks the writer is alive
+
+_CLEAR = object()
+_INCREMENT = object()
+_COMPACT = object()
+
+
+class SQLiteHistory(HistoryStore):
+    """History persisted to a SQLite database in WAL mode
+
+    Appends are queued and written by a background thread, which commits
+    everything that queued up while the previous commit was running in a
+    single transaction (group commit). Each writer waits for the commit
+    holding its write, so returned records carry their ids and a failed
+    commit raises HistoryWriteError instead of losing the scan. Reads
+    wait only for writes queued before them.
+    """
+
+    def __init__(self, path, capacity=100, max_batch=500):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.path = path
+        self.capacity = capacity
+        self.max_batch = max_batch
+
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._progress = threading.Condition()
+        self._queued = 0
+        self._written = 0
+        self._failed = collections.deque(maxlen=1000)  # (first ticket, last ticket, error)
+        self._writer = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(scans)')]
+        if columns and 'created' not in columns:
+            self._migrate(conn, columns)
+        conn.executescript(SCHEMA)
+        conn.commit()
+        atexit.register(self.flush)
+
+    def _migrate(self, conn, columns):
+        # Older databases stored ISO timestamps and may lack repeat counts
+        count = 'count' if 'count' in columns else '1'
+        rows = conn.execute(f'SELECT id, content, type, timestamp, {count} FROM scans').fetchall()
+        conn.execute('ALTER TABLE scans RENAME TO scans_old')
+        conn.execute(SCANS_TABLE)
+        conn.executemany(
+            'INSERT INTO scans (id, content, type, created, count) VALUES (?, ?, ?, ?, ?)',
+            [(row[0], row[1], row[2], datetime.fromisoformat(row[3]).timestamp(), row[4])
+             for row in rows])
+        conn.execute('DROP TABLE scans_old')
+        conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_writer(self):
+        # Threads do not survive a fork, so each worker starts its own writer
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._write_loop,
+                                            name='sqlite-history-writer', daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+
+    def _enqueue(self, item):
+        self._ensure_writer()
+        with self._progress:
+            # Tickets must follow queue order, so both happen under the lock
+            self._queued += 1
+            self._queue.put(item)
+            return self._queued
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            error = None
+            try:
+                self._commit(conn, batch)
+            except Exception as e:
+                logger.exception('Failed to write %d items to %s', len(batch), self.path)
+                error = e
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    conn.close()
+                    conn = self._connect()
+            with self._progress:
+                # Tickets are handed out in queue order, so a batch is a ticket range
+                if error is not None:
+                    self._failed.append((self._written + 1, self._written + len(batch), error))
+                self._written += len(batch)
+                self._progress.notify_all()
+
+    def _commit(self, conn, batch):
+        evicted = 0
+        for item in batch:
+            if item is _CLEAR:
+                conn.execute('DELETE FROM scans')
+                conn.execute("UPDATE history_meta SET value = value + 1 WHERE name = 'clears'")
+            elif isinstance(item, tuple) and item[0] is _INCREMENT:
+                _, record, by = item
+                conn.execute('UPDATE scans SET count = count + ? WHERE id = ?', (by, record.id))
+                conn.execute("UPDATE history_meta SET value = value + 1 WHERE name = 'updates'")
+            elif isinstance(item, tuple) and item[0] is _COMPACT:
+                evicted += self._compact(conn, *item[1:])
+            else:
+                for record in (item if isinstance(item, list) else [item]):
+                    # Repeats are queued as separate increments, so start at 1
+                    cursor = conn.execute(
+                        'INSERT INTO scans (content, type, created) VALUES (?, ?, ?)',
+                        (record.content, record.type, record.created))
+                    record.id = cursor.lastrowid
+        evicted += conn.execute('DELETE FROM scans WHERE id <= (SELECT MAX(id) FROM scans) - ?',
+                                (self.capacity,)).rowcount
+        if evicted:
+            conn.execute("UPDATE history_meta SET value = value + ? WHERE name = 'evictions'",
+                         (evicted,))
+        conn.commit()
+
+    def _compact(self, conn, min_created, max_bytes):
+        removed = 0
+        if min_created is not None:
+            removed += conn.execute('DELETE FROM scans WHERE created < ?', (min_created,)).rowcount
+        if max_bytes is not None:
+            # Newest-first running total; everything from the first row over
+            # the budget backwards is dropped
+            row = conn.execute(
+                f'SELECT id FROM (SELECT id, SUM({ROW_BYTES}) OVER (ORDER BY id DESC) AS total'
+                ' FROM scans) WHERE total > ? ORDER BY id DESC LIMIT 1',
+                (max_bytes,)).fetchone()
+            if row is not None:
+                removed += conn.execute('DELETE FROM scans WHERE id <= ?', (row[0],)).rowcount
+        return removed
+
+    def _wait(self, ticket):
+        with self._progress:
+            while self._written < ticket:
+                if (not self._progress.wait(WAIT_POLL_SECONDS)
+                        and not self._writer.is_alive() and self._written < ticket):
+                    raise HistoryWriteError(f'The writer for {self.path} has stopped')
+
+    def _write(self, item):
+        """Queue a write and wait for its commit; raises HistoryWriteError if it failed"""
+        ticket = self._enqueue(item)
+        self._wait(ticket)
+        for first, last, error in self._failed:
+            if first <= ticket <= last:
+                raise HistoryWriteError(f'Writing to {self.path} failed: {error}') from error
+
+    def flush(self):
+        """Block until every queued write has been committed"""
+        with self._progress:
+            ticket = self._queued
+        self._wait(ticket)
+
+    def append(self, content, type, created):
+        return self.extend([(content, type, created)])[0]
+
+    def extend(self, scans):
+        # Queued as one item so the whole batch lands in one transaction;
+        # SQLite assigns the ids as the writer commits it
+        records = [ScanRecord(None, *scan) for scan in scans]
+        if records:
+            self._write(records)
+        return records
+
+    def increment(self, record, by=1):
+        self._write((_INCREMENT, record, by))
+        record.count += by
+
+    def contains(self, record):
+        if record.id is None:
+            return False
+        self.flush()
+        return self._reader().execute('SELECT 1 FROM scans WHERE id = ?',
+                                      (record.id,)).fetchone() is not None
+
+    def clear(self):
+        self._write(_CLEAR)
+
+    def compact(self, min_created=None, max_bytes=None):
+        self._write((_COMPACT, min_created, max_bytes))
+
+    def _query(self, sql, params=()):
+        self.flush()
+        for row in self._reader().execute(sql, params):
+            yield ScanRecord(*row)
+
+    def __iter__(self):
+        return self._query(f'SELECT {COLUMNS} FROM scans ORDER BY id DESC')
+
+    def _range_query(self, since, until, before):
+        conditions = []
+        params = []
+        for condition, value in (('created >= ?', since), ('created <= ?', until),
+                                 ('id < ?', before)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return f'SELECT {COLUMNS} FROM scans{where} ORDER BY id DESC', params
+
+    def iter_range(self, since=None, until=None, before=None):
+        return self._query(*self._range_query(since, until, before))
+
+    def page(self, before=None, limit=50, since=None, until=None):
+        sql, params = self._range_query(since, until, before)
+        return list(self._query(sql + ' LIMIT ?', params + [limit]))
+
+    def __len__(self):
+        self.flush()
+        return self._reader().execute('SELECT COUNT(*) FROM scans').fetchone()[0]
+
+    @property
+    def bytes_used(self):
+        # The payload compaction trims to; the file itself only shrinks on VACUUM
+        self.flush()
+        return self._reader().execute(f'SELECT COALESCE(SUM({ROW_BYTES}), 0) FROM scans').fetchone()[0]
+
+    @property
+    def evictions(self):
+        self.flush()
+        return self._reader().execute(
+            "SELECT value FROM history_meta WHERE name = 'evictions'").fetchone()[0]
+
+    @property
+    def clears(self):
+        # Committed clears only; a caller's own clear has committed when clear() returns
+        return self._reader().execute(
+            "SELECT value FROM history_meta WHERE name = 'clears'").fetchone()[0]
+
+    @property
+    def store_id(self):
+        return f'sqlite:{socket.gethostname()}:{os.path.abspath(self.path)}'
+
+    @property
+    def version(self):
+        # AUTOINCREMENT's sequence only grows, a clear changes the count and
+        # repeat counting bumps the updates counter
+        self.flush()
+        row = self._reader().execute(
+            "SELECT (SELECT seq FROM sqlite_sequence WHERE name = 'scans'),"
+            " (SELECT COUNT(*) FROM scans),"
+            " (SELECT value FROM history_meta WHERE name = 'updates')").fetchone()
+        return '%d-%d-%d' % (row[0] or 0, row[1], row[2])